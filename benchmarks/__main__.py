@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 nggit
+
+import asyncio
+import csv
+import json
+import multiprocessing as mp
+import os
+import signal
+import socket
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# makes imports relative from the repo directory
+sys.path.insert(0, PROJECT_DIR)
+
+from tremolo import Application  # noqa: E402
+from tremolo.utils import parse_args  # noqa: E402
+from httpout import HTTPOut  # noqa: E402
+from benchmarks.client import load  # noqa: E402
+
+app = Application()
+
+HTTPOut(app)
+
+DOCUMENT_ROOT = os.path.join(PROJECT_DIR, 'benchmarks', 'docroot')
+FIELDS = ('scenario', 'requests', 'errors', 'concurrency', 'duration',
+          'rps', 'p50', 'p99')
+
+SCENARIOS = {
+    'hello': {'path': '/hello.py'},
+    'static': {'path': '/static.html'},
+    'deep_imports': {'path': '/deep.py'},
+    'stream': {'path': '/stream.py'},
+    'form': {
+        'path': '/form.py',
+        'method': b'POST',
+        'headers': (b'Content-Type: application/x-www-form-urlencoded',),
+        'body': b'foo=bar&baz=qux'
+    },
+    'websocket': {'path': '/ws.py', 'websocket': True},
+    'hybrid': {'path': '/hybrid.py'}
+}
+
+
+def usage(**context):
+    print('Usage: python3 -m benchmarks [OPTIONS]')
+    print()
+    print('Starts an httpout server with the scenario scripts in benchmarks/docroot')  # noqa: E501
+    print('and measures the throughput and latency of each scenario.')
+    print()
+    print('Options:')
+    print('  --scenarios               Comma-separated list of scenarios to run')  # noqa: E501
+    print('                            Defaults to all: %s' % ','.join(SCENARIOS))  # noqa: E501
+    print('  --requests                Requests per scenario. Defaults to 1000')  # noqa: E501
+    print('  --concurrency             Concurrent connections. Defaults to 10')
+    print('  --output                  Write the results to a .json or .csv file')  # noqa: E501
+    print('  --baseline                Compare the results against a .json file')  # noqa: E501
+    print('                            previously written with --output')
+    print('  --threshold               Tolerated regression in percent')
+    print('                            Defaults to 10')
+    print('  --port                    Defaults to 8000')
+    print('  --worker-num              Defaults to 1')
+    print('  --thread-pool-size        Defaults to 5')
+    print('  --help                    Show this help and exit')
+    return 0
+
+
+def number(value, **context):
+    try:
+        return int(value)
+    except ValueError:
+        print(f'Invalid value "{value}". It must be a number')
+        sys.exit(1)
+
+
+def scenarios(value, **context):
+    for name in value.split(','):
+        if name not in SCENARIOS:
+            print(f'Unknown scenario "{name}"')
+            return 1
+
+    context['options']['scenarios'] = value.split(',')
+
+
+def requests(value, **context):
+    context['options']['requests'] = number(value)
+
+
+def concurrency(value, **context):
+    context['options']['concurrency'] = number(value)
+
+
+def output(value, **context):
+    if not value.endswith(('.json', '.csv')):
+        print('--output must be a .json or .csv file')
+        return 1
+
+    context['options']['output'] = value
+
+
+def baseline(value, **context):
+    context['options']['baseline'] = value
+
+
+def threshold(value, **context):
+    context['options']['threshold'] = number(value)
+
+
+def wait_for_server(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+
+    raise TimeoutError(f'server is not ready after {timeout}s')
+
+
+def write_results(results, filename):
+    if filename.endswith('.csv'):
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(filename, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def compare(results, filename, threshold=10):
+    with open(filename, 'r') as f:
+        baselines = {item['scenario']: item for item in json.load(f)}
+
+    regressions = []
+
+    for result in results:
+        base = baselines.get(result['scenario'])
+
+        if base is None:
+            continue
+
+        for key, worse in (('rps', -1), ('p99', 1)):
+            if not base[key]:
+                continue
+
+            change = (result[key] - base[key]) / base[key] * 100
+            print('  %-14s %-4s %10.3f -> %10.3f (%+.1f%%)' % (
+                result['scenario'], key, base[key], result[key], change)
+            )
+
+            if change * worse > threshold:
+                regressions.append((result['scenario'], key, change))
+
+    return regressions
+
+
+def main():
+    options = parse_args(
+        help=usage, scenarios=scenarios, requests=requests,
+        concurrency=concurrency, output=output, baseline=baseline,
+        threshold=threshold
+    )
+    host = options['host']
+    port = options['port']
+
+    mp.set_start_method('spawn', force=True)
+
+    p = mp.Process(
+        target=app.run,
+        kwargs=dict(
+            host=host, port=port, document_root=DOCUMENT_ROOT, app=None,
+            worker_num=options.get('worker_num', 1),
+            thread_pool_size=options.get('thread_pool_size', 5),
+            debug=False, log_level='ERROR'
+        )
+    )
+    p.start()
+    results = []
+
+    try:
+        wait_for_server(host, port)
+        print('%-14s %8s %7s %10s %10s %10s' % (
+            'scenario', 'requests', 'errors', 'rps', 'p50 (ms)', 'p99 (ms)')
+        )
+
+        for name in options.get('scenarios', SCENARIOS):
+            scenario = SCENARIOS[name]
+            clients = options.get('concurrency', 10)
+            total = options.get('requests', 1000)
+
+            # warm up the code cache and the connections
+            asyncio.run(load(host, port, scenario,
+                             requests=max(total // 10, clients),
+                             concurrency=clients))
+
+            result = {'scenario': name}
+            result.update(asyncio.run(load(host, port, scenario,
+                                           requests=total,
+                                           concurrency=clients)))
+            results.append(result)
+
+            print('%-14s %8d %7d %10.1f %10.3f %10.3f' % (
+                name, result['requests'], result['errors'], result['rps'],
+                result['p50'], result['p99'])
+            )
+    finally:
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+            p.join()
+
+    if 'output' in options:
+        write_results(results, options['output'])
+        print('results written to', options['output'])
+
+    if 'baseline' in options:
+        print('compared to', options['baseline'])
+        regressions = compare(results, options['baseline'],
+                              options.get('threshold', 10))
+
+        if regressions:
+            for name, key, change in regressions:
+                print(f'REGRESSION: {name} {key} {change:+.1f}%')
+
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
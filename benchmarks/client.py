@@ -0,0 +1,206 @@
+# Copyright (c) 2024 nggit
+
+__all__ = ('percentile', 'http_request', 'ws_connect', 'ws_echo', 'load')
+
+import asyncio  # noqa: E402
+import base64  # noqa: E402
+import os  # noqa: E402
+
+from time import perf_counter  # noqa: E402
+
+
+def percentile(values, p):
+    # values must be sorted
+    if not values:
+        return 0.0
+
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+
+    if i + 1 < len(values):
+        return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+    return values[i]
+
+
+async def read_headers(reader):
+    header = await reader.readuntil(b'\r\n\r\n')
+    status = int(header[9:12])
+    headers = {}
+
+    for line in header.split(b'\r\n')[1:-2]:
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip()
+
+    return status, headers
+
+
+async def read_body(reader, headers):
+    if b'content-length' in headers:
+        return await reader.readexactly(int(headers[b'content-length']))
+
+    if headers.get(b'transfer-encoding', b'').lower() != b'chunked':
+        # read until the connection is closed
+        return await reader.read()
+
+    body = bytearray()
+
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        size = int(line.split(b';', 1)[0], 16)
+
+        if size == 0:
+            await reader.readuntil(b'\r\n')  # no trailers
+            return bytes(body)
+
+        body.extend(await reader.readexactly(size + 2))
+        del body[-2:]
+
+
+async def http_request(reader, writer, data):
+    writer.write(data)
+
+    while True:
+        status, headers = await read_headers(reader)
+
+        if status != 100:
+            break
+
+    body = await read_body(reader, headers)
+
+    return status, headers, body
+
+
+def ws_frame(payload):
+    # client frames must be masked
+    mask = os.urandom(4)
+    size = len(payload)
+
+    if size < 126:
+        header = bytes((0x82, 0x80 | size))
+    elif size < 65536:
+        header = bytes((0x82, 0x80 | 126)) + size.to_bytes(2, 'big')
+    else:
+        header = bytes((0x82, 0x80 | 127)) + size.to_bytes(8, 'big')
+
+    return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(
+        payload))
+
+
+async def ws_connect(reader, writer, host, port, path):
+    key = base64.b64encode(os.urandom(16))
+    writer.write(
+        b'GET %s HTTP/1.1\r\nHost: %s:%d\r\n'
+        b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+        b'Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n' % (
+            path.encode('latin-1'), host.encode('latin-1'), port, key
+        )
+    )
+    status, _ = await read_headers(reader)
+
+    if status != 101:
+        raise ConnectionError(f'websocket handshake failed ({status})')
+
+
+async def ws_echo(reader, writer, payload):
+    writer.write(ws_frame(payload))
+    first_byte, second_byte = await reader.readexactly(2)
+    size = second_byte & 0x7f
+
+    if size == 126:
+        size = int.from_bytes(await reader.readexactly(2), 'big')
+    elif size == 127:
+        size = int.from_bytes(await reader.readexactly(8), 'big')
+
+    data = await reader.readexactly(size)
+
+    if first_byte & 0x0f == 8:
+        raise ConnectionError('websocket closed by the server')
+
+    return data
+
+
+async def load(host, port, scenario, requests=1000, concurrency=10,
+               timeout=30):
+    # scenario: {'path': ..., 'method': ..., 'headers': ..., 'body': ...}
+    # or {'path': ..., 'websocket': True, 'body': ...}
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    if scenario.get('websocket'):
+        data = scenario.get('body', b'Hello, World!')
+    else:
+        body = scenario.get('body', b'')
+        headers = [
+            b'Host: %s:%d' % (host.encode('latin-1'), port),
+            *scenario.get('headers', ())
+        ]
+
+        if body:
+            headers.append(b'Content-Length: %d' % len(body))
+
+        data = b'%s %s HTTP/1.1\r\n%s\r\n\r\n%s' % (
+            scenario.get('method', b'GET'), scenario['path'].encode('latin-1'),
+            b'\r\n'.join(headers), body
+        )
+
+    async def worker():
+        nonlocal errors, remaining
+
+        reader = writer = None
+
+        while remaining > 0:
+            remaining -= 1
+
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+
+                    if scenario.get('websocket'):
+                        await ws_connect(reader, writer,
+                                         host, port, scenario['path'])
+
+                start = perf_counter()
+
+                if scenario.get('websocket'):
+                    await asyncio.wait_for(ws_echo(reader, writer, data),
+                                           timeout)
+                else:
+                    status, headers, _ = await asyncio.wait_for(
+                        http_request(reader, writer, data), timeout
+                    )
+
+                    if status >= 400:
+                        raise ConnectionError(f'unexpected status {status}')
+
+                    if headers.get(b'connection', b'').lower() == b'close':
+                        writer.close()
+                        writer = None
+
+                latencies.append(perf_counter() - start)
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError):
+                errors += 1
+
+                if writer is not None:
+                    writer.close()
+                    writer = None
+
+        if writer is not None:
+            writer.close()
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'duration': round(duration, 3),
+        'rps': round(len(latencies) / duration, 1) if duration else 0.0,
+        'p50': round(percentile(latencies, 50) * 1000, 3),  # ms
+        'p99': round(percentile(latencies, 99) * 1000, 3)
+    }
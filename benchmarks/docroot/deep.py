@@ -0,0 +1,4 @@
+from lib.level1 import depth
+
+
+print(depth())
@@ -0,0 +1,4 @@
+from httpout import wait, request
+
+
+print(wait(request.form()))
@@ -0,0 +1,16 @@
+import asyncio
+
+from httpout import run, wait
+
+
+async def double(value):
+    await asyncio.sleep(0)
+    return value * 2
+
+
+async def main():
+    print(await double(1))
+
+
+print(wait(double(2)))
+run(main())
@@ -0,0 +1,5 @@
+from . import level2
+
+
+def depth():
+    return level2.depth() + 1
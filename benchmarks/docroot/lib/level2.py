@@ -0,0 +1,5 @@
+from . import level3
+
+
+def depth():
+    return level3.depth() + 1
@@ -0,0 +1,5 @@
+from . import level4
+
+
+def depth():
+    return level4.depth() + 1
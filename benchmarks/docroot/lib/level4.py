@@ -0,0 +1,5 @@
+from . import level5
+
+
+def depth():
+    return level5.depth() + 1
@@ -0,0 +1,5 @@
+from . import level6
+
+
+def depth():
+    return level6.depth() + 1
@@ -0,0 +1,5 @@
+from . import level7
+
+
+def depth():
+    return level7.depth() + 1
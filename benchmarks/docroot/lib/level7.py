@@ -0,0 +1,5 @@
+from . import level8
+
+
+def depth():
+    return level8.depth() + 1
@@ -0,0 +1,5 @@
+from . import level9
+
+
+def depth():
+    return level9.depth() + 1
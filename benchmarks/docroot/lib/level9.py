@@ -0,0 +1,5 @@
+from . import level10
+
+
+def depth():
+    return level10.depth() + 1
@@ -0,0 +1,9 @@
+from httpout import run, websocket
+
+
+async def main():
+    async for data in websocket:
+        await websocket.send(data)
+
+
+run(main())
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024 nggit
+
+import asyncio
+import builtins
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+
+from time import perf_counter_ns
+from types import ModuleType
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# makes imports relative from the repo directory
+sys.path.insert(0, PROJECT_DIR)
+
+from tremolo import Application  # noqa: E402
+from tremolo.lib.contexts import WorkerContext  # noqa: E402
+from tremolo.utils import parse_args  # noqa: E402
+from httpout import HTTPOut  # noqa: E402
+from httpout.response import HTTPResponse  # noqa: E402
+from httpout.utils import (  # noqa: E402
+    is_safe_path, resolve_path, new_module, exec_module, cleanup_modules
+)
+
+DOCUMENT_ROOT = os.path.join(PROJECT_DIR, 'benchmarks', 'docroot')
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None):
+    # setup() returns the arguments of a single call, it is not timed
+    def decorator(func):
+        BENCHMARKS[name] = (func, setup)
+        return func
+
+    return decorator
+
+
+def measure(func, setup=None, number=1000, repeat=5, warmup=100):
+    for _ in range(warmup):
+        func(*setup()) if setup else func()
+
+    timings = []
+
+    for _ in range(repeat):
+        elapsed = 0
+
+        if setup is None:
+            start = perf_counter_ns()
+
+            for _ in range(number):
+                func()
+
+            elapsed = perf_counter_ns() - start
+        else:
+            for _ in range(number):
+                args = setup()
+                start = perf_counter_ns()
+                func(*args)
+                elapsed += perf_counter_ns() - start
+
+        timings.append(elapsed / number)
+
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': round(min(timings), 1),  # ns per call
+        'median': round(statistics.median(timings), 1),
+        'mean': round(statistics.mean(timings), 1),
+        'stdev': round(statistics.stdev(timings), 1) if repeat > 1 else 0.0
+    }
+
+
+# the former path normalisation block of HTTPOut._on_request,
+# superseded by resolve_path()
+def normalize_path(path, document_root=DOCUMENT_ROOT):
+    path_info = path[(path + '.py/').find('.py/') + 3:]
+
+    if path_info:
+        path = path[:path.rfind(path_info)]
+        path_info = os.path.normpath(path_info).replace(os.sep, '/')
+
+    module_path = os.path.abspath(
+        os.path.join(document_root, os.path.normpath(path.lstrip('/')))
+    )
+
+    if not module_path.startswith(document_root):
+        raise ValueError('Path traversal is not allowed')
+
+    if '/.' in path and not path.startswith('/.well-known/'):
+        raise ValueError('Access to dotfiles is prohibited')
+
+    if not is_safe_path(path):
+        raise ValueError('Unsafe URL detected')
+
+    return module_path, path_info, os.path.splitext(module_path)[-1]
+
+
+@benchmark('is_safe_path')
+def bench_is_safe_path():
+    is_safe_path('/foo/bar-baz/index.py')
+
+
+@benchmark('normalize_path (legacy)')
+def bench_normalize_path():
+    normalize_path('/foo/bar-baz/index.py/path/info')
+
+
+@benchmark('resolve_path')
+def bench_resolve_path():
+    resolve_path('/foo/bar-baz/index.py/path/info')
+
+
+@benchmark('resolve_path (not normalized)')
+def bench_resolve_path_slow():
+    resolve_path('/foo//bar-baz/index.py/path//info/')
+
+
+@benchmark('new_module')
+def bench_new_module():
+    new_module('lib.level1', 0, DOCUMENT_ROOT)
+
+
+class FakeServer:
+    loop = None
+    options = {}
+    logger = logging.getLogger('benchmarks')
+
+
+class FakeRequest:
+    server = FakeServer
+    protocol = None
+    upgraded = False
+
+
+class FakeResponse:
+    request = FakeRequest
+
+    def headers_sent(self, sent=False):
+        return True
+
+    async def write(self, data, **kwargs):
+        pass
+
+
+class Context:
+    def __init__(self):
+        self.worker = WorkerContext()
+        self.worker.options['document_root'] = DOCUMENT_ROOT
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.response = None
+        self.py_import = builtins.__import__
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def __enter__(self):
+        self.thread.start()
+        FakeServer.loop = self.loop
+        self.response = HTTPResponse(FakeResponse())
+
+        # installs ho_import the same way a worker does
+        cwd = os.getcwd()
+        self.wait(HTTPOut(Application())._on_worker_start(
+            loop=self.loop, logger=FakeServer.logger, globals=self.worker
+        ))
+        os.chdir(cwd)
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        builtins.__import__ = self.py_import
+        sys.path.remove(DOCUMENT_ROOT)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def wait(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def new_main(self):
+        module = ModuleType('__main__')
+        module.__file__ = os.path.join(DOCUMENT_ROOT, 'deep.py')
+        module.__main__ = module
+        module.__server__ = {
+            'modules': {'__main__': module},
+            'DOCUMENT_ROOT': DOCUMENT_ROOT,
+            'imports': self.worker.imports,
+            'trace': None
+        }
+        module.print = self.response.print
+        module.run = self.response.run_coroutine
+
+        return module
+
+
+def register_context_benchmarks(ctx):
+    filename = os.path.join(ctx.tmpdir.name, 'synthetic.py')
+
+    with open(filename, 'w') as f:
+        for i in range(50):
+            f.write(f'def func{i}(a, b=1):\n    return a + b + {i}\n\n')
+
+        f.write('class Foo:\n    x = 1\n\n    def bar(self):\n'
+                '        return self.x\n\n')
+        f.write('DATA = {"a": [1, 2, 3], "b": (4, 5, 6)}\n')
+
+    def synthetic():
+        module = ModuleType('synthetic')
+        module.__file__ = filename
+
+        return module
+
+    code = exec_module(synthetic())
+
+    benchmark('exec_module (compile)', lambda: (synthetic(),))(exec_module)
+    benchmark('exec_module (cached code)', lambda: (synthetic(), code))(
+        exec_module
+    )
+
+    def graph(size=50):
+        # a module holding functions, classes and nested instances
+        module = ModuleType('__main__')
+        exec(code, module.__dict__)  # nosec B102
+
+        for i in range(size):
+            obj = module.Foo()
+            obj.child = module.Foo()
+            obj.child.items = list(range(10))
+            setattr(module, f'obj{i}', obj)
+
+        return ({'__main__': module, 'synthetic': module},)
+
+    benchmark('cleanup_modules', graph)(cleanup_modules)
+
+    def import_chain(module):
+        # 10 levels of relative imports, resolved by ho_import/load_module
+        builtins.__import__('lib.level1', module.__dict__, None, ('depth',))
+
+    benchmark('ho_import (10 modules)', lambda: (ctx.new_main(),))(
+        import_chain
+    )
+
+    def print_roundtrip():
+        ctx.response.print('Hello, World!')
+        ctx.wait(ctx.response.join())
+
+    def write_bytes_roundtrip():
+        ctx.response.write_bytes(b'Hello, World!\n')
+        ctx.wait(ctx.response.join())
+
+    def writelines_roundtrip():
+        ctx.response.writelines((b'Hello, World!\n',) * 100)
+        ctx.wait(ctx.response.join())
+
+    def call_soon_roundtrip():
+        ctx.response.call_soon(len, 'Hello, World!')
+
+    benchmark('HTTPResponse.print')(print_roundtrip)
+    benchmark('HTTPResponse.write_bytes')(write_bytes_roundtrip)
+    benchmark('HTTPResponse.writelines')(writelines_roundtrip)
+    benchmark('HTTPResponse.call_soon')(call_soon_roundtrip)
+
+
+def usage(**context):
+    print('Usage: python3 -m benchmarks.micro [OPTIONS]')
+    print()
+    print('Times the internal functions that run on every request.')
+    print()
+    print('Options:')
+    print('  --filter                  Only run benchmarks containing this text')  # noqa: E501
+    print('  --number                  Calls per round. Defaults to 1000')
+    print('  --repeat                  Rounds. Defaults to 5')
+    print('  --output                  Write the results to a .json file')
+    print('  --help                    Show this help and exit')
+    return 0
+
+
+def number(value, **context):
+    try:
+        context['options']['number'] = int(value)
+    except ValueError:
+        print(f'Invalid value "{value}". It must be a number')
+        return 1
+
+
+def repeat(value, **context):
+    try:
+        context['options']['repeat'] = int(value)
+    except ValueError:
+        print(f'Invalid value "{value}". It must be a number')
+        return 1
+
+
+def filter(value, **context):
+    context['options']['filter'] = value
+
+
+def output(value, **context):
+    context['options']['output'] = value
+
+
+def main():
+    options = parse_args(help=usage, number=number, repeat=repeat,
+                         filter=filter, output=output)
+    logging.basicConfig(level=logging.WARNING)
+    results = {}
+
+    with Context() as ctx:
+        register_context_benchmarks(ctx)
+
+        print('%-28s %12s %12s %12s %10s' % (
+            'benchmark', 'min (ns)', 'median (ns)', 'mean (ns)', 'stdev')
+        )
+
+        for name, (func, setup) in BENCHMARKS.items():
+            if options.get('filter', '') not in name:
+                continue
+
+            result = results[name] = measure(
+                func, setup,
+                number=options.get('number', 1000),
+                repeat=options.get('repeat', 5)
+            )
+
+            print('%-28s %12.1f %12.1f %12.1f %10.1f' % (
+                name, result['min'], result['median'], result['mean'],
+                result['stdev'])
+            )
+
+    if 'output' in options:
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+        print('results written to', options['output'])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 
+import sqlite3
 import __main__
 
-from httpout import app, modules
+from httpout import app, modules, pool
 
 # just for testing. the only thing that matters here is the `app` :)
 assert __main__ is modules['__globals__']
@@ -11,6 +12,16 @@ assert __main__ is modules['__globals__']
 counter = 0
 
 
+# a connection is checked out per request with `pool.get('db')`
+# and will be returned automatically at the end of the request
+pool.register(
+    'db',
+    lambda: sqlite3.connect(':memory:', check_same_thread=False),
+    max_size=1,
+    check=lambda conn: conn.execute('SELECT 1')
+)
+
+
 # this middleware is usually not placed here but in a separate package
 class _MyMiddleware:
     def __init__(self, app):
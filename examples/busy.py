@@ -0,0 +1,5 @@
+import time
+
+# holds its executor thread for a while
+time.sleep(0.5)
+print('Done!')
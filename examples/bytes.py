@@ -0,0 +1,25 @@
+from httpout import response
+
+
+response.set_content_type('application/octet-stream')
+
+buf = bytearray(b'\x02\x03')
+
+# sent without str() and encode()
+response.write_bytes(b'\x00\x01')
+response.write_bytes(buf)
+buf[:] = b'\xff\xff'  # already copied
+
+response.write_bytes(memoryview(b'\x00\x04\x05\x06')[1:])
+print(end='')  # nothing to write
+
+# gathered into fewer writes
+response.writelines(bytes((i,)) for i in range(7, 10))
+
+# only buffers are accepted. bytes(3) would be 3 null bytes,
+# and the items of b'ab' are ints
+for func, data in ((response.write_bytes, 3), (response.writelines, b'ab')):
+    try:
+        func(data)
+    except TypeError:
+        response.write_bytes(b'!')
@@ -0,0 +1,9 @@
+from httpout import hub, websocket
+
+# the script thread blocks on each message,
+# the hub sends it to all subscribers from the event loop
+hub.subscribe(websocket, 'chat')
+websocket.send('joined')
+
+for message in websocket:
+    hub.publish(message, 'chat')
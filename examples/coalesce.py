@@ -0,0 +1,11 @@
+import time
+
+from httpout import response, shared
+
+
+# with --coalesce /coalesce.py, identical concurrent requests
+# are served from a single execution
+response.set_header('X-Execution', str(shared.incr('coalesce')))
+
+time.sleep(0.5)
+print('Hello, World!')
@@ -0,0 +1,15 @@
+import time
+
+from httpout import response, shared
+
+
+# with --coalesce /coalesce_flush.py, the followers get the same
+# headers and body, but not the end of the response twice
+response.set_header('X-Execution', str(shared.incr('coalesce_flush')))
+response.flush_headers()
+
+time.sleep(0.5)
+print('Hello, World!')
+
+response.finish()
+print('This is not sent')
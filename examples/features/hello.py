@@ -0,0 +1 @@
+print('Hello, World!')
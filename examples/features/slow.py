@@ -0,0 +1,8 @@
+import time
+
+
+# stopped by --slow-request-exception, if any
+for _ in range(100):
+    time.sleep(0.1)
+
+print('Done!')
@@ -0,0 +1,15 @@
+import hashlib
+
+from httpout import wait, request
+
+# the uploaded files above --upload-spool-size are already on the disk,
+# upload.move('/path/to/dest') renames them instead of copying
+files = wait(request.files())
+form = wait(request.form())
+
+for name, uploads in files.items():
+    for upload in uploads:
+        print(name, upload.filename, upload.content_type, upload.size,
+              hashlib.sha256(upload.read()).hexdigest(), upload.spooled())
+
+print(form)
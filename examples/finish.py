@@ -0,0 +1,18 @@
+import time
+
+from httpout import defer, response, shared
+
+
+def audit():
+    # runs after the response, the client does not wait for it
+    shared.incr('finished')
+
+
+defer(audit)
+print(shared.get('finished', 0))
+
+# completes the response, the rest of the script keeps running
+response.finish()
+
+time.sleep(0.5)
+print('This is not sent')
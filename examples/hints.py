@@ -0,0 +1,13 @@
+import time
+
+from httpout import response
+
+
+# lets the browser fetch the stylesheet while the script is working
+response.early_hints('</static/style.css>; rel=preload; as=style')
+
+response.set_header('Link', '</static/style.css>; rel=preload; as=style')
+response.flush_headers()
+
+time.sleep(0.1)  # e.g. a slow query
+print('<link rel="stylesheet" href="/static/style.css">Hello, World!')
@@ -0,0 +1,6 @@
+
+from httpout import pool
+
+db = pool.get('db', timeout=1)
+
+print(db.execute('SELECT 1 + 1').fetchone()[0])
@@ -0,0 +1,20 @@
+import asyncio
+import time
+
+from httpout import response
+
+
+async def main():
+    await asyncio.sleep(2)
+
+
+run(main())  # noqa: F821
+start = time.time()
+
+# neither waits for main()
+response.flush_headers()
+
+# above --max-write-buffer-size, print() blocks until the client
+# has read enough, not until main() is done
+print('x' * 1048576)
+print('waited for main():', time.time() - start >= 2)
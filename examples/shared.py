@@ -0,0 +1,5 @@
+
+from httpout import shared
+
+# `shared` is seen consistently by all worker processes
+print(shared.incr('hits'))
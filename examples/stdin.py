@@ -0,0 +1,4 @@
+import sys
+
+# available with --stdin, like a CGI script
+print(''.join(line.upper() for line in sys.stdin), end='')
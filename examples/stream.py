@@ -0,0 +1,4 @@
+# prints faster than the client reads, print() blocks when the
+# write buffer (--max-write-buffer-size) is full
+for i in range(10000):
+    print('line', i)
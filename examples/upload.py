@@ -0,0 +1,13 @@
+import hashlib
+
+from httpout import request
+
+# the body is read in chunks as it arrives, instead of as a whole
+digest = hashlib.sha256()
+size = 0
+
+for data in iter(lambda: request.stream.read(65536), b''):
+    digest.update(data)
+    size += len(data)
+
+print(size, digest.hexdigest())
@@ -3,4 +3,11 @@
 __version__ = '0.1.1'
 __all__ = ('HTTPOut',)
 
+from time import perf_counter  # noqa: E402
+
+# reported by --startup-profile
+IMPORT_TIME = perf_counter()
+
 from .httpout import HTTPOut  # noqa: E402
+
+IMPORT_TIME = perf_counter() - IMPORT_TIME
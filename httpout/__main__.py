@@ -1,14 +1,24 @@
 # Copyright (c) 2024 nggit
 
+import builtins
+import os
 import sys
 
+from time import perf_counter
+
 import tremolo
 
-from httpout import __version__, HTTPOut
+from httpout import __version__, IMPORT_TIME, HTTPOut
+from httpout.utils import SharedState
+from httpout.utils.collector import POLICIES
+
+# the duration of each phase in the main process, see --startup-profile
+TIMINGS = {'import': IMPORT_TIME, 'app': perf_counter()}
 
 app = tremolo.Application()
+httpout = HTTPOut(app)
 
-HTTPOut(app)
+TIMINGS['app'] = perf_counter() - TIMINGS['app']
 
 
 def usage(**context):
@@ -37,6 +47,69 @@ def usage(**context):
     print('                            E.g. "/path/to/privkey.pem"')
     print('  --directory-index         Index files to be served on directory-based URLs')  # noqa: E501
     print('                            Must be separated by commas. E.g. "index.py,index.html"')  # noqa: E501
+    print('  --shared-memory-size      Size (in KiB) of the state shared across workers')  # noqa: E501
+    print('                            Available as "from httpout import shared"')  # noqa: E501
+    print('                            Defaults to 0 or disabled')
+    print('  --metrics-path            Serve Prometheus metrics of the worker at this URL')  # noqa: E501
+    print('                            E.g. "/metrics". Defaults to disabled')  # noqa: E501
+    print('  --profile-secret          Profile a script request carrying this value in the')  # noqa: E501
+    print('                            "X-Profile" header. Defaults to disabled')  # noqa: E501
+    print('  --profile-dir             Directory to write the profiles (cProfile) to')  # noqa: E501
+    print('                            Defaults to "httpout" inside the temp directory')  # noqa: E501
+    print('  --access-log              Write an access log record per request to this file')  # noqa: E501
+    print('                            Or "stderr". Defaults to disabled')
+    print('  --access-log-format       Python\'s log format with the fields: remote_addr,')  # noqa: E501
+    print('                            method, uri, version, status, size, duration,')  # noqa: E501
+    print('                            script and user_agent')
+    print('  --access-log-json         Write the access log records as JSON')
+    print('  --trace-file              Write the spans of each request to this file')  # noqa: E501
+    print('                            as OpenTelemetry JSON lines. Defaults to disabled')  # noqa: E501
+    print('  --server-timing           Summarize the spans in a Server-Timing header')  # noqa: E501
+    print('                            Defaults to disabled')
+    print('  --max-write-buffer-size   Size (in KiB) of print() output buffered per response')  # noqa: E501
+    print('                            before the script blocks. Defaults to 64')  # noqa: E501
+    print('  --background-pool-size    Number of threads per process running the')  # noqa: E501
+    print('                            deferred callables. Defaults to 2')  # noqa: E501
+    print('  --upload-dir              Directory for the uploaded files of request.files()')  # noqa: E501
+    print('                            Defaults to the temp directory')
+    print('  --upload-spool-size       Size (in KiB) of an uploaded file kept in memory')  # noqa: E501
+    print('                            before it is written to --upload-dir')  # noqa: E501
+    print('                            Defaults to 1024')
+    print('  --stdin                   Map sys.stdin of the scripts to the request body')  # noqa: E501
+    print('                            CGI-style. Defaults to disabled')
+    print('  --preload                 Import and compile the document root in the main')  # noqa: E501
+    print('                            process once, before forking the workers')  # noqa: E501
+    print('                            Defaults to disabled')
+    print('  --preload-modules         Modules to import with --preload, must be')  # noqa: E501
+    print('                            separated by commas. E.g. "numpy,jinja2"')  # noqa: E501
+    print('  --coalesce                Share one execution among identical concurrent')  # noqa: E501
+    print('                            GET / HEAD requests to these scripts. Must be')  # noqa: E501
+    print('                            separated by commas. E.g. "/news.py,/feeds/"')  # noqa: E501
+    print('                            Defaults to disabled')
+    print('  --coalesce-headers        Request headers that must also be identical')  # noqa: E501
+    print('                            Must be separated by commas. Defaults to')  # noqa: E501
+    print('                            "accept,accept-encoding,accept-language"')  # noqa: E501
+    print('  --atomic-deploy           Follow DOCUMENT_ROOT if it is a symlink that is')  # noqa: E501
+    print('                            swapped on deploy, e.g. current -> releases/N')  # noqa: E501
+    print('                            Defaults to disabled')
+    print('  --memory-sample-rate      Compare the tracemalloc snapshots of 1 in every')  # noqa: E501
+    print('                            this many script requests. Defaults to 0 or disabled')  # noqa: E501
+    print('  --memory-report-path      Serve the memory retained per script at this URL')  # noqa: E501
+    print('                            E.g. "/memory". Defaults to disabled')  # noqa: E501
+    print('  --slow-request-timeout    Log the stack of a script running longer than')  # noqa: E501
+    print('                            this many seconds. Defaults to disabled')  # noqa: E501
+    print('  --slow-request-exception  Also raise this built-in exception in it')  # noqa: E501
+    print('                            E.g. "TimeoutError". Defaults to disabled')  # noqa: E501
+    print('  --max-requests            Replace a worker after it has served this many')  # noqa: E501
+    print('                            requests. Defaults to 0 or disabled')  # noqa: E501
+    print('  --max-requests-jitter     Add a random number of requests up to this')  # noqa: E501
+    print('                            to --max-requests of each worker. Defaults to 0')  # noqa: E501
+    print('  --gc-policy               "default" or "idle". "idle" freezes the worker')  # noqa: E501
+    print('                            after startup and defers the full collections')  # noqa: E501
+    print('                            until no scripts are running')
+    print('                            Defaults to "default"')
+    print('  --startup-profile         Print the duration of each startup phase')  # noqa: E501
+    print('                            in the main process and the workers')  # noqa: E501
     print('  --debug                   Enable debug mode')
     print('                            Intended for development')
     print('  --log-level               Defaults to "DEBUG". See')
@@ -95,11 +168,244 @@ def indexes(value, **context):
     context['options']['directory_index'] = value.split(',')
 
 
+def shared_memory(value, **context):
+    try:
+        context['options']['shared_memory_size'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --shared-memory-size value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def metrics_path(value, **context):
+    if not value.startswith('/'):
+        print(f'Invalid --metrics-path value "{value}". It must start with "/"')  # noqa: E501
+        return 1
+
+    context['options']['metrics_path'] = value
+
+
+def profile_secret(value, **context):
+    context['options']['profile_secret'] = value
+
+
+def profile_dir(value, **context):
+    context['options']['profile_dir'] = os.path.abspath(value)
+
+
+def access_log(value, **context):
+    if value == 'stderr':
+        context['options']['access_log'] = None
+    else:
+        context['options']['access_log'] = os.path.abspath(value)
+
+
+def access_log_format(value, **context):
+    context['options']['access_log_format'] = value
+
+
+def access_log_json(**context):
+    context['options']['access_log_json'] = True
+
+
+def trace_file(value, **context):
+    context['options']['trace_file'] = os.path.abspath(value)
+
+
+def server_timing(**context):
+    context['options']['server_timing'] = True
+
+
+def memory_sample_rate(value, **context):
+    try:
+        rate = int(value)
+
+        if rate < 1:
+            raise ValueError
+
+        context['options']['memory_sample_rate'] = rate
+    except ValueError:
+        print(
+            f'Invalid --memory-sample-rate value "{value}". '
+            'It must be a number, 1 or greater'
+        )
+        return 1
+
+
+def memory_report_path(value, **context):
+    context['options']['memory_report_path'] = value
+
+
+def slow_request_timeout(value, **context):
+    try:
+        context['options']['slow_request_timeout'] = float(value)
+    except ValueError:
+        print(
+            f'Invalid --slow-request-timeout value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def slow_request_exception(value, **context):
+    exc_type = getattr(builtins, value, None)
+
+    if not (isinstance(exc_type, type) and
+            issubclass(exc_type, BaseException)):
+        print(
+            f'Invalid --slow-request-exception value "{value}". '
+            'It must be a built-in exception, e.g. TimeoutError'
+        )
+        return 1
+
+    context['options']['slow_request_exception'] = value
+
+
+def background_pool_size(value, **context):
+    try:
+        context['options']['background_pool_size'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --background-pool-size value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def upload_dir(value, **context):
+    context['options']['upload_dir'] = os.path.abspath(value)
+
+
+def upload_spool_size(value, **context):
+    try:
+        context['options']['upload_spool_size'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --upload-spool-size value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def stdin(**context):
+    context['options']['stdin'] = True
+
+
+def preload(**context):
+    context['options']['preload'] = True
+
+
+def preload_modules(value, **context):
+    context['options']['preload'] = True
+    context['options']['preload_modules'] = [
+        name.strip() for name in value.split(',') if name.strip()
+    ]
+
+
+def coalesce(value, **context):
+    paths = [path.strip() for path in value.split(',') if path.strip()]
+
+    for path in paths:
+        if not path.startswith('/'):
+            print(f'Invalid --coalesce value "{path}". It must start with "/"')  # noqa: E501
+            return 1
+
+    context['options']['coalesce'] = paths
+
+
+def coalesce_headers(value, **context):
+    context['options']['coalesce_headers'] = [
+        name.strip().lower().encode('latin-1')
+        for name in value.split(',') if name.strip()
+    ]
+
+
+def atomic_deploy(**context):
+    context['options']['atomic_deploy'] = True
+
+
+def max_requests(value, **context):
+    try:
+        context['options']['max_requests'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --max-requests value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def max_requests_jitter(value, **context):
+    try:
+        context['options']['max_requests_jitter'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --max-requests-jitter value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
+def gc_policy(value, **context):
+    if value not in POLICIES:
+        print(
+            f'Invalid --gc-policy value "{value}". '
+            f'It must be one of: {", ".join(POLICIES)}'
+        )
+        return 1
+
+    context['options']['gc_policy'] = value
+
+
+def startup_profile(**context):
+    context['options']['startup_profile'] = True
+
+
+def print_timings(timings):
+    print('Startup profile:')
+
+    for name, duration in timings.items():
+        print('  %-10s %9.3f ms' % (name, duration * 1000))
+
+    print('  %-10s %9.3f ms' % ('total', sum(timings.values()) * 1000))
+    print()
+
+
+def max_write_buffer(value, **context):
+    try:
+        context['options']['max_write_buffer_size'] = int(value)
+    except ValueError:
+        print(
+            f'Invalid --max-write-buffer-size value "{value}". '
+            'It must be a number'
+        )
+        return 1
+
+
 if __name__ == '__main__':
+    TIMINGS['cli'] = perf_counter()
     options = tremolo.utils.parse_args(
         help=usage, bind=bind, version=version, thread_pool_size=threads,
-        directory_index=indexes
+        directory_index=indexes, shared_memory_size=shared_memory,
+        metrics_path=metrics_path, profile_secret=profile_secret,
+        profile_dir=profile_dir, access_log=access_log,
+        access_log_format=access_log_format, access_log_json=access_log_json,
+        trace_file=trace_file, server_timing=server_timing,
+        max_write_buffer_size=max_write_buffer, stdin=stdin,
+        upload_dir=upload_dir, upload_spool_size=upload_spool_size,
+        preload=preload, preload_modules=preload_modules,
+        startup_profile=startup_profile, atomic_deploy=atomic_deploy,
+        coalesce=coalesce, coalesce_headers=coalesce_headers,
+        background_pool_size=background_pool_size,
+        memory_sample_rate=memory_sample_rate,
+        memory_report_path=memory_report_path,
+        slow_request_timeout=slow_request_timeout,
+        slow_request_exception=slow_request_exception, gc_policy=gc_policy,
+        max_requests=max_requests, max_requests_jitter=max_requests_jitter
     )
+    TIMINGS['cli'] = perf_counter() - TIMINGS['cli']
 
     if sys.argv[-1] != sys.argv[0] and not sys.argv[-1].startswith('-'):
         options['document_root'] = sys.argv[-1]
@@ -111,4 +417,33 @@ if __name__ == '__main__':
     if 'server_name' not in options:
         options['server_name'] = 'HTTPOut'
 
-    app.run(**options)
+    if options.get('shared_memory_size', 0) > 0:
+        # must be created before the workers are spawned
+        options['shared'] = SharedState(options['shared_memory_size'] * 1024)
+
+    if options.pop('preload', False):
+        TIMINGS['preload'] = perf_counter()
+
+        # shared copy-on-write by the workers, only with the fork start method
+        document_root = options['document_root']
+
+        if options.get('atomic_deploy'):
+            # the workers start with the current release
+            document_root = os.path.realpath(document_root)
+
+        try:
+            httpout.preload(document_root, options.pop('preload_modules', ()))
+        except ImportError as exc:
+            print(f'Cannot preload: {exc}')
+            sys.exit(1)
+
+        TIMINGS['preload'] = perf_counter() - TIMINGS['preload']
+
+    if options.get('startup_profile'):
+        print_timings(TIMINGS)
+
+    try:
+        app.run(**options)
+    finally:
+        if 'shared' in options:
+            options['shared'].close()
@@ -2,29 +2,240 @@
 
 import asyncio
 import builtins
+import gc
+import importlib
 import os
 import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from hmac import compare_digest
+from time import perf_counter
 from types import ModuleType
 
-from tremolo.exceptions import BadRequest, NotFound, Forbidden
-from tremolo.lib.websocket import WebSocket
+from tremolo.exceptions import HTTPException, BadRequest, NotFound, Forbidden
 from tremolo.utils import html_escape
 
-from .request import HTTPRequest
+from .request import HTTPRequest, ScriptStdin
 from .response import HTTPResponse
+from .websocket import WebSocket
 from .utils import (
-    is_safe_path, new_module, exec_module, cleanup_modules, mime_types
+    resolve_path, new_module, exec_module, cleanup_modules, mime_types
 )
+from .utils.access_log import DEFAULT_FORMAT, AccessLog
+from .utils.coalesce import DEFAULT_HEADERS, Coalescer
+from .utils.collector import Collector
+from .utils.deploy import Deploys
+from .utils.hub import Hub
+from .utils.imports import ImportGraph
+from .utils.metrics import Metrics
+from .utils.pool import Pool, PoolSession
+from .utils.recycle import Recycler
+from .utils.tracing import Tracer, current_trace
+from .utils.watchdog import Watchdog
+
+
+def run_module(module, code, timings):
+    # runs in the executor thread
+    watchdog = module.__server__.get('watchdog')
+
+    if watchdog is None:
+        timings['exec'] = perf_counter()
+    else:
+        watchdog.enter(module.__server__)
+
+    if isinstance(sys.stdin, ScriptStdin):
+        sys.stdin.set(module.__server__['request'])
+
+    trace = module.__server__['trace']
+    token = current_trace.set(trace)
+
+    if trace is not None:
+        trace.add('queue', timings['queue'], timings['exec'])
+
+    try:
+        if code is None:
+            # compiles the local imports ahead, instead of one by one
+            # as ho_import meets them
+            imports = module.__server__['imports']
+            start = perf_counter()
+            imports.analyze(module.__file__)
+            code = imports.get_code(module.__file__)
+
+            if trace is not None:
+                trace.add('compile', start, perf_counter(),
+                          modules=len(imports.modules))
+
+            exec_module(module, code)
+
+            return code
+
+        return exec_module(module, code)
+    finally:
+        try:
+            if watchdog is None:
+                timings['exec_end'] = perf_counter()
+            else:
+                # first, the interrupt can still be raised until leave()
+                # has cleared it, even if the script has returned
+                while True:
+                    try:
+                        watchdog.leave(module.__server__)
+                        break
+                    except watchdog.exc_types:
+                        pass
+        finally:
+            current_trace.reset(token)
+
+            if isinstance(sys.stdin, ScriptStdin):
+                sys.stdin.set()
+
+
+def pick_thread(jobs, size):
+    # prefers an idle thread, rather than the last active one.
+    # when all of them are busy, the job is queued on the thread
+    # with the fewest scripts. jobs maps a thread index to that number
+    return min(range(size), key=lambda i: jobs.get(i, 0))
+
+
+def run_deferred(deferred, logger, metrics=None):
+    # runs in the background pool, after the response has finished
+    for func, args, kwargs in deferred:
+        start = perf_counter()
+        status = 'ok'
+
+        try:
+            func(*args, **kwargs)
+        except Exception as exc:
+            status = 'error'
+            logger.error('deferred %s has failed: %s',
+                         getattr(func, '__name__', func), exc, exc_info=exc)
+        finally:
+            if metrics is not None:
+                metrics.inc('httpout_background_tasks_total', status=status)
+                metrics.observe('httpout_background_seconds',
+                                perf_counter() - start)
+
+
+def profile_module(module, code, timings, filename, limit=3):
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is active, Python 3.12+
+        return run_module(module, code, timings)
+
+    try:
+        return run_module(module, code, timings)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+
+        # a Server-Timing summary of the functions with the most own time
+        stats = pstats.Stats(profiler).sort_stats('tottime')
+        timings['profile'] = ', '.join(
+            'p%d;dur=%.3f;desc="%s:%d(%s)"' % (
+                i, stats.stats[func][2] * 1000,
+                os.path.basename(func[0]), *func[1:]
+            ) for i, func in enumerate(stats.fcn_list[:limit], 1)
+        ).replace('\\', '').encode('ascii', 'replace')
+
+
+def create_metrics(g):
+    metrics = Metrics()
+
+    metrics.counter('httpout_requests_total',
+                    'Total number of script requests.')
+    metrics.histogram('httpout_request_phase_seconds',
+                      'Time spent in each phase of a script request.')
+    metrics.counter('httpout_code_cache_hits_total',
+                    'Script executions that used a cached code object.')
+    metrics.counter('httpout_code_cache_misses_total',
+                    'Script executions that needed a compilation.')
+    metrics.counter('httpout_coalesced_requests_total',
+                    'Script requests served from an identical one.')
+    metrics.counter('httpout_background_tasks_total',
+                    'Deferred callables run after the response.')
+    metrics.histogram('httpout_background_seconds',
+                      'Time spent running a deferred callable.')
+    metrics.counter('httpout_slow_requests_total',
+                    'Scripts reported by the watchdog, per report.')
+    metrics.histogram('httpout_gc_pause_seconds',
+                      'Time spent in a garbage collection.')
+    metrics.counter('httpout_static_bytes_total',
+                    'Size of the static files served, not the bytes sent.')
+    metrics.gauge(
+        'httpout_executor_queue_depth',
+        'Jobs waiting for an executor thread.',
+        lambda: sum(thread.queue.qsize() for thread in g.executor.threads)
+    )
+    metrics.gauge(
+        'httpout_executor_active_threads',
+        'Executor threads currently running a script.',
+        lambda: sum(1 for server in g.requests.values()
+                    if 'exec' in server['timings'] and
+                    'exec_end' not in server['timings'])
+    )
+    metrics.gauge(
+        'httpout_response_tasks',
+        'Pending write tasks of the in-flight responses.',
+        lambda: sum(len(server['response'].tasks)
+                    for server in g.requests.values())
+    )
+
+    return metrics
+
+
+def observe_request(metrics, script_name, timings):
+    metrics.inc('httpout_requests_total', script=script_name)
+
+    for phase, end in (('queue', 'exec'),
+                       ('exec', 'exec_end'),
+                       ('write', 'cleanup'),
+                       ('cleanup', 'end')):
+        if phase in timings and end in timings:
+            metrics.observe('httpout_request_phase_seconds',
+                            timings[end] - timings[phase],
+                            script=script_name, phase=phase)
+
+
+def add_spans(trace, timings, cached):
+    if 'exec_end' in timings:
+        trace.add('exec', timings['exec'], timings['exec_end'],
+                  cached=cached)
+
+    if 'write' in timings:
+        trace.add('flush', timings['write'], timings['cleanup'])
 
 
 class HTTPOut:
     def __init__(self, app):
+        self.imports = None
+
         app.add_hook(self._on_worker_start, 'worker_start')
+        app.add_hook(self._on_worker_stop, 'worker_stop')
         app.add_hook(self._on_close, 'close')
         app.add_middleware(self._on_request, 'request', priority=9999)  # low
 
+    def preload(self, document_root, modules=()):
+        # runs in the main process. the forked workers inherit
+        # the imported modules and the compiled document root
+        for name in modules:
+            importlib.import_module(name)
+
+        self.imports = ImportGraph(os.path.abspath(document_root))
+        self.imports.preload()
+
+        # moves everything so far out of the collections, which would
+        # otherwise write to the shared pages and copy them in each worker
+        gc.freeze()
+        return self.imports
+
     async def _on_worker_start(self, **worker):
+        started_at = perf_counter()
         loop = worker['loop']
         logger = worker['logger']
         g = worker['globals']
@@ -44,10 +255,190 @@ class HTTPOut:
         module = new_module('__globals__')
         worker['__globals__'] = module or ModuleType('__globals__')
         worker['modules'] = {'__globals__': worker['__globals__']}
+
+        if 'shared' in g.options:
+            # a cross-process state, e.g. from httpout import shared
+            worker['shared'] = g.options['shared']
+
+        # resource pools, e.g. DB connections, registered in __globals__.py
+        g.pool = worker['pool'] = Pool(logger)
+
+        # websocket pub/sub, e.g. from httpout import hub
+        g.hub = worker['hub'] = Hub(loop, logger)
+
+        def on_change(path, dependents):
+            logger.debug('%s: modified, %d dependents', path, len(dependents))
+
+            for module_path in (path, *dependents):
+                g.caches.pop(module_path, None)
+
+        def create_imports(root):
+            if self.imports is not None and self.imports.document_root == root:
+                logger.info('using %d preloaded modules',
+                            len(self.imports.modules))
+                self.imports.on_change = on_change
+                return self.imports
+
+            return ImportGraph(root, on_change=on_change)
+
+        def on_deploy(generation, previous):
+            logger.info('deploy: generation %d at %s',
+                        generation.number, generation.root)
+
+            # the working directory is per process, not per request.
+            # it follows the newest release, even for the requests
+            # still running on the previous one
+            os.chdir(generation.root)
+
+            # warms up the new release with what the previous one compiled,
+            # rather than letting the next requests compile them all at once
+            paths = [
+                os.path.join(generation.root, path[len(previous.root):]
+                             .lstrip(os.sep))
+                for path in previous.imports.modules
+            ]
+            loop.run_in_executor(None, generation.imports.preload, paths)
+
+        def on_retire(generation):
+            logger.info('deploy: generation %d retired', generation.number)
+
+            if g.deploys.is_live(generation.root):  # rolled back
+                return
+
+            for module_path in list(g.caches):
+                if module_path.startswith(generation.root + os.sep):
+                    del g.caches[module_path]
+
+        # the releases of the document root, see --atomic-deploy.
+        # each has its own compiled local modules,
+        # e.g. from httpout import imports
+        g.deploys = Deploys(
+            document_root, create_imports,
+            interval=1 if g.options.get('atomic_deploy') else None,
+            on_change=on_deploy, on_retire=on_retire
+        )
+        g.imports = worker['imports'] = g.deploys.current().imports
+
+        # in-flight script requests
+        g.requests = {}
+
+        # the number of scripts queued or running on each executor thread,
+        # including the ones that keep running after response.finish(),
+        # until their cleanup. see pick_thread()
+        g.busy_threads = {}
+
+        # runs the deferred callables, e.g. from httpout import defer
+        g.background = ThreadPoolExecutor(
+            max_workers=g.options.get('background_pool_size', 2),
+            thread_name_prefix='httpout-background'
+        )
+
+        if g.options.get('coalesce'):
+            g.coalescer = Coalescer(
+                loop, g.options['coalesce'],
+                headers=g.options.get('coalesce_headers', DEFAULT_HEADERS)
+            )
+        else:
+            g.coalescer = None
+
+        if g.options.get('profile_secret'):
+            import tempfile
+
+            g.options.setdefault(
+                'profile_dir', os.path.join(tempfile.gettempdir(), 'httpout')
+            )
+            os.makedirs(g.options['profile_dir'], exist_ok=True)
+            logger.info('profiles will be written to: %s',
+                        g.options['profile_dir'])
+
+        if g.options.get('upload_dir'):
+            os.makedirs(g.options['upload_dir'], exist_ok=True)
+
+        if g.options.get('metrics_path'):
+            g.metrics = create_metrics(g)
+            g.metrics_path = g.options['metrics_path'].encode('latin-1')
+        else:
+            g.metrics = None
+
+        if 'access_log' in g.options:
+            g.access_log = AccessLog(
+                g.options['access_log'],
+                g.options.get('access_log_format') or DEFAULT_FORMAT,
+                json=g.options.get('access_log_json', False)
+            )
+            g.access_log.start()
+        else:
+            g.access_log = None
+
+        if g.options.get('trace_file') or g.options.get('server_timing'):
+            g.tracer = Tracer(g.options.get('trace_file'),
+                              server_timing=g.options.get('server_timing',
+                                                          False))
+            g.tracer.start()
+        else:
+            g.tracer = None
+
+        if g.options.get('max_requests'):
+            if self.imports is None:
+                # a replacement worker compiles the document root before
+                # taking traffic, rather than on its first requests
+                logger.info('compiled %d modules', g.imports.preload())
+
+            g.recycler = Recycler(
+                loop, logger,
+                lambda: not any(generation.requests
+                                for generation in g.deploys.generations),
+                g.options['max_requests'],
+                jitter=g.options.get('max_requests_jitter', 0),
+                timeout=g.options.get('shutdown_timeout', 30) / 2
+            )
+        else:
+            g.recycler = None
+
+        if g.options.get('memory_sample_rate'):
+            from .utils.memory import MemoryTracker
+
+            g.memory = MemoryTracker(g.background, logger,
+                                     rate=g.options['memory_sample_rate'])
+            g.memory.start()
+            logger.info('memory: sampling 1 in %d requests',
+                        g.memory.rate)
+        else:
+            g.memory = None
+
+        if g.options.get('memory_report_path'):
+            g.memory_report_path = g.options['memory_report_path'].encode(
+                'latin-1'
+            )
+        else:
+            g.memory_report_path = None
+
+        if g.options.get('slow_request_timeout'):
+            exc_type = g.options.get('slow_request_exception')
+            g.watchdog = Watchdog(
+                g.requests, logger, g.options['slow_request_timeout'],
+                exc_type=exc_type and getattr(builtins, exc_type),
+                metrics=g.metrics
+            )
+            g.watchdog_task = loop.create_task(g.watchdog.run())
+        else:
+            g.watchdog = None
+
+        if g.options.get('stdin'):
+            # CGI-style, sys.stdin of a script reads its request body
+            sys.stdin = ScriptStdin(sys.stdin)
+
         py_import = builtins.__import__
 
         def wait(coro, timeout=None):
-            return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+            fut = asyncio.run_coroutine_threadsafe(coro, loop)
+            trace = current_trace.get()
+
+            if trace is None:
+                return fut.result(timeout)
+
+            with trace.span('wait'):
+                return fut.result(timeout)
 
         def load_module(name, globals, level=0):
             if '__server__' in globals:
@@ -59,10 +450,16 @@ class HTTPOut:
                 # already imported
                 return modules[name]
 
-            module = new_module(name, level, document_root)
+            # the release of the request, or of __globals__
+            if '__server__' in globals:
+                imports = globals['__server__']['imports']
+            else:
+                imports = g.imports
+
+            module = new_module(name, level, imports.document_root)
 
             if module:
-                logger.info('%s: importing %s', globals['__name__'], name)
+                logger.debug('%s: importing %s', globals['__name__'], name)
 
                 if '__server__' in globals:
                     module.__main__ = globals['__main__']
@@ -72,17 +469,28 @@ class HTTPOut:
                     module.wait = wait
 
                 modules[name] = module
-                exec_module(module)
+                trace = current_trace.get()
+
+                if trace is None:
+                    exec_module(module, imports.get_code(module.__file__))
+                else:
+                    with trace.span(f'import {name}'):
+                        exec_module(module, imports.get_code(module.__file__))
 
                 return module
 
         def ho_import(name, globals=None, locals=None, fromlist=(), level=0):
             if (name not in sys.builtin_module_names and
                     globals is not None and '__file__' in globals and
-                    globals['__file__'].startswith(document_root)):
+                    globals['__file__'].startswith(
+                        globals['__server__']['DOCUMENT_ROOT']
+                        if '__server__' in globals else
+                        g.imports.document_root
+                    )):
                 # satisfy import __main__
                 if name == '__main__':
-                    logger.info('%s: importing __main__', globals['__name__'])
+                    logger.debug('%s: importing __main__',
+                                 globals['__name__'])
 
                     if globals['__name__'] == '__globals__':
                         return worker['__globals__']
@@ -151,45 +559,159 @@ class HTTPOut:
         g.caches = {}
 
         if module:
-            exec_module(module)
+            globals_started_at = perf_counter()
+            exec_module(module, g.imports.get_code(module.__file__))
+
+            if g.options.get('startup_profile'):
+                logger.info('startup: __globals__ %.3f ms',
+                            (perf_counter() - globals_started_at) * 1000)
+
+        gc_policy = g.options.get('gc_policy', 'default')
+
+        if g.metrics is not None or gc_policy != 'default':
+            # reports the GC pauses, and see --gc-policy
+            g.collector = Collector(loop, lambda: not g.requests,
+                                    policy=gc_policy, metrics=g.metrics)
+            g.collector.start()
+        else:
+            g.collector = None
+
+        if g.options.get('startup_profile'):
+            logger.info('startup: worker_start %.3f ms',
+                        (perf_counter() - started_at) * 1000)
+
+    async def _on_worker_stop(self, **worker):
+        g = worker['globals']
+
+        if g.get('memory') is not None:
+            g.memory.stop()
+
+        if g.get('collector') is not None:
+            g.collector.stop()
+
+        if 'background' in g:
+            # waits for the deferred callables
+            await g.executor.submit(g.background.shutdown)
+
+        if 'pool' in g:
+            await g.executor.submit(g.pool.close)
+
+        if g.get('access_log') is not None:
+            g.access_log.stop()
+
+        if g.get('tracer') is not None:
+            g.tracer.stop()
+
+        if g.get('watchdog') is not None:
+            g.watchdog_task.cancel()
+
+        if isinstance(sys.stdin, ScriptStdin):
+            sys.stdin = sys.stdin.stdin
 
     async def _on_request(self, **server):
+        g = server['globals']
+
+        if g.recycler is not None:
+            g.recycler.count(server['request'])
+
+        if g.tracer is None:
+            server['trace'] = None
+        else:
+            server['trace'] = g.tracer.new_trace(server['request'])
+
+        # pins the request to the current release of the document root.
+        # nothing may raise between here and the try, or it is never released
+        server['generation'] = generation = g.deploys.acquire()
+
+        try:
+            if g.access_log is None:
+                return await self._handle_request(server)
+
+            return await self._log_request(server)
+        finally:
+            g.deploys.release(generation)
+
+            if server['trace'] is not None:
+                if isinstance(server.get('response'), HTTPResponse):
+                    g.tracer.export(server['trace'], **{
+                        'http.response.status_code': server['response'].status
+                    })
+                else:
+                    g.tracer.export(server['trace'])
+
+    async def _log_request(self, server):
+        g = server['globals']
+        start = perf_counter()
+        status = 500
+        size = 0
+
+        try:
+            result = await self._handle_request(server)
+
+            if isinstance(server['response'], HTTPResponse):  # a script
+                status = server['response'].status
+                size = server['response'].size
+            else:
+                status = 200
+                size = server.get('content_length', 0)
+
+            return result
+        except HTTPException as exc:
+            status = exc.code
+            raise
+        finally:
+            g.access_log.log(server['request'], status, size,
+                             perf_counter() - start,
+                             server.get('SCRIPT_NAME', '-'))
+
+    async def _handle_request(self, server):
         request = server['request']
         response = server['response']
         logger = server['logger']
         ctx = server['context']
         g = server['globals']
-        document_root = g.options['document_root']
+        document_root = server['generation'].root
+        trace = server['trace']
+        start = perf_counter()
 
         if not request.is_valid:
             raise BadRequest
 
+        if g.metrics is not None and request.path == g.metrics_path:
+            response.set_content_type(
+                b'text/plain; version=0.0.4; charset=utf-8'
+            )
+            data = g.metrics.render().encode('utf-8')
+            server['content_length'] = len(data)
+
+            return data
+
+        if (g.memory_report_path is not None and
+                request.path == g.memory_report_path):
+            response.set_content_type(b'text/plain; charset=utf-8')
+
+            if g.memory is None:
+                data = b'# disabled, see --memory-sample-rate\n'
+            else:
+                data = g.memory.render(document_root).encode('utf-8')
+
+            server['content_length'] = len(data)
+
+            return data
+
         # no need to unquote path
         # in fact, the '%' character in the path will be rejected.
         # httpout strictly uses A-Z a-z 0-9 - _ . for directory names
         # which does not need the use of percent-encoding
         path = request.path.decode('latin-1')
-        path_info = path[(path + '.py/').find('.py/') + 3:]
-
-        if path_info:
-            path = path[:path.rfind(path_info)]
-            path_info = os.path.normpath(path_info).replace(os.sep, '/')
-
-        module_path = os.path.abspath(
-            os.path.join(document_root, os.path.normpath(path.lstrip('/')))
-        )
-
-        if not module_path.startswith(document_root):
-            raise Forbidden('Path traversal is not allowed')
 
-        if '/.' in path and not path.startswith('/.well-known/'):
-            raise Forbidden('Access to dotfiles is prohibited')
+        try:
+            segments, path_info, ext = resolve_path(path)
+        except ValueError as exc:
+            raise Forbidden(str(exc))
 
-        if not is_safe_path(path):
-            raise Forbidden('Unsafe URL detected')
-
-        dirname, basename = os.path.split(module_path)
-        ext = os.path.splitext(basename)[-1]
+        module_path = os.path.join(document_root, *segments)
+        basename = segments[-1] if segments else ''
         request_uri = request.url.decode('latin-1')
 
         if ext == '':
@@ -206,9 +728,12 @@ class HTTPOut:
         if basename.startswith('_') or not os.path.isfile(module_path):
             raise NotFound('URL not found:', html_escape(request_uri))
 
+        if trace is not None:
+            trace.add('route', start, perf_counter(), **{'url.path': path})
+
         if ext == '.py':
             # begin loading the module
-            logger.info('%s -> __main__: %s', path, module_path)
+            logger.debug('%s -> __main__: %s', path, module_path)
 
             server['request'] = HTTPRequest(request, server)
             server['response'] = HTTPResponse(response)
@@ -217,7 +742,11 @@ class HTTPOut:
                     b'sec-websocket-key' in request.headers and
                     b'upgrade' in request.headers and
                     request.headers[b'upgrade'].lower() == b'websocket'):
-                server['websocket'] = WebSocket(request, response)
+                from tremolo.lib import websocket
+
+                server['websocket'] = WebSocket(
+                    websocket.WebSocket(request, response), server['response']
+                )
             else:
                 server['websocket'] = None
 
@@ -232,6 +761,33 @@ class HTTPOut:
             server['REQUEST_URI'] = request_uri
             server['REQUEST_SCHEME'] = request.scheme.decode('latin-1')
             server['DOCUMENT_ROOT'] = document_root
+            server['imports'] = server['generation'].imports
+            flight = None
+
+            if (g.coalescer is not None and server['websocket'] is None and
+                    g.coalescer.accepts(request, server['SCRIPT_NAME'])):
+                key = g.coalescer.key(request, module_path)
+                flight, leader = g.coalescer.join(key)
+
+                if not leader:
+                    # an identical request is running the script already
+                    logger.debug('%s: waiting for the same request', path)
+
+                    if await g.coalescer.replay(flight, server['response']):
+                        if g.metrics is not None:
+                            g.metrics.inc('httpout_coalesced_requests_total')
+
+                        return b''
+
+                    # not shareable, e.g. it has failed or set a cookie
+                    flight = None
+
+            server['response'].flight = flight
+            server['response'].trace = trace
+
+            if trace is not None:
+                server['response'].server_timing = g.tracer.server_timing
+            shareable = False
 
             module = ModuleType('__main__')
             module.__file__ = module_path
@@ -241,34 +797,136 @@ class HTTPOut:
             module.print = server['response'].print
             module.run = server['response'].run_coroutine
             module.wait = g.wait
+            server['pool'] = PoolSession(g.pool)
+            server['defer'] = server['response'].defer
+            server['watchdog'] = g.watchdog
             code = g.caches.get(module_path, None)
 
             if code:
-                logger.info('%s: using cache', path)
+                logger.debug('%s: using cache', path)
+
+            if g.metrics is not None:
+                g.metrics.inc('httpout_code_cache_%s_total' %
+                              ('hits' if code else 'misses'))
+
+            if g.memory is None:
+                memory = None
+            else:
+                # a snapshot of the allocations before the sampled requests
+                memory = await g.memory.sample()
+
+            timings = server['timings'] = {'queue': perf_counter()}
+            g.requests[id(server)] = server
+            func = run_module
+            args = (module, code, timings)
+
+            secret = request.headers.get(b'x-profile')
+
+            if (isinstance(secret, bytes) and
+                    g.options.get('profile_secret') and
+                    compare_digest(secret,
+                                   g.options['profile_secret'].encode())):
+                filename = '%d-%d%s.prof' % (
+                    time.time() * 1000, os.getpid(),
+                    server['SCRIPT_NAME'].replace('/', '_')
+                )
+                func = profile_module
+                args += (os.path.join(g.options['profile_dir'], filename),)
+
+                response.set_header(b'X-Profile-Report', filename)
+                logger.debug('%s: profiling to %s', path, filename)
+
+            thread = pick_thread(g.busy_threads, g.executor.size)
+            g.busy_threads[thread] = g.busy_threads.get(thread, 0) + 1
 
             try:
                 # execute module in another thread
-                result = await g.executor.submit(exec_module,
-                                                 args=(module, code))
+                result = await g.executor.submit(func, args=args, name=thread)
+
+                timings['write'] = perf_counter()
+
+                if ('profile' in timings and
+                        not server['response'].headers_sent()):
+                    response.append_header(b'Server-Timing',
+                                           timings['profile'])
+
                 await server['response'].join()
+                shareable = True
 
                 if result:
                     g.caches[module_path] = result
-                    logger.info('%s: cached', path)
+                    logger.debug('%s: cached', path)
                 else:
                     # cache is going to be deleted on @app.on_close
                     # but it can be delayed on a Keep-Alive request
                     ctx.module_path = module_path
             except BaseException as exc:
+                timings.setdefault('write', perf_counter())
                 await server['response'].join()
                 await server['response'].handle_exception(exc)
+                shareable = isinstance(exc, SystemExit) and not exc.code
             finally:
-                await g.executor.submit(
-                    cleanup_modules,
-                    args=(server['modules'], g.options['debug'])
-                )
+                timings['cleanup'] = perf_counter()
+
+                if trace is not None:
+                    add_spans(trace, timings, code is not None)
+
+                if flight is not None:
+                    # wakes up the identical requests waiting for this one
+                    g.coalescer.finish(key, flight, response, shareable)
+
+                if server['response'].deferred:
+                    try:
+                        # the client does not wait for them
+                        await server['response'].end()
+                    finally:
+                        await asyncio.wrap_future(g.background.submit(
+                            run_deferred, server['response'].deferred,
+                            logger, g.metrics
+                        ))
+
+                # return the checked out resources before they get cleaned up
+                server['pool'].release_all()
+
+                # stops reading ahead the body of request.stream, if any
+                server['request'].close()
+
+                if server['websocket'] is not None:
+                    g.hub.unsubscribe(server['websocket'])
+
+                try:
+                    await g.executor.submit(
+                        cleanup_modules,
+                        args=(server['modules'], g.options['debug']),
+                        name=thread
+                    )
+                finally:
+                    # the thread is still used until the cleanup is done
+                    if g.busy_threads[thread] == 1:
+                        del g.busy_threads[thread]
+                    else:
+                        g.busy_threads[thread] -= 1
                 await server['response'].join()
                 server['modules'].clear()
+
+                timings['end'] = perf_counter()
+                del g.requests[id(server)]
+
+                if g.metrics is not None:
+                    observe_request(g.metrics, server['SCRIPT_NAME'], timings)
+
+                if trace is not None:
+                    trace.add('cleanup', timings['cleanup'], timings['end'])
+
+                if memory is not None:
+                    g.memory.track(server['SCRIPT_NAME'], memory)
+
+                if g.collector is not None:
+                    g.collector.request_done()
+            if server['response'].finished:
+                # ended by response.finish() or defer()
+                return True
+
             # EOF
             return b''
 
@@ -276,9 +934,18 @@ class HTTPOut:
         if ext not in mime_types:
             raise Forbidden(f'Disallowed file extension: {ext}')
 
-        logger.info('%s -> %s: %s', path, mime_types[ext], module_path)
+        logger.debug('%s -> %s: %s', path, mime_types[ext], module_path)
         await response.sendfile(module_path, content_type=mime_types[ext])
 
+        if g.metrics is not None or g.access_log is not None:
+            # the file size. a Range or a conditional request is answered
+            # by sendfile() with 206 or 304, which is not known here
+            server['content_length'] = os.path.getsize(module_path)
+
+            if g.metrics is not None:
+                g.metrics.inc('httpout_static_bytes_total',
+                              server['content_length'])
+
         # exit middleware without closing the connection
         return True
 
@@ -289,4 +956,4 @@ class HTTPOut:
 
         if 'module_path' in ctx:
             g.caches[ctx.module_path] = None
-            logger.info('cache deleted: %s', ctx.module_path)
+            logger.debug('cache deleted: %s', ctx.module_path)
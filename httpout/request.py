@@ -1,10 +1,251 @@
 # Copyright (c) 2024 nggit
 
+import asyncio
+import io
+import threading
+
+from collections.abc import Coroutine
+
+from tremolo.exceptions import BadRequest, PayloadTooLarge
+
+from .utils.upload import UploadFile
+
+
+class RequestBody(io.RawIOBase):
+    # a blocking view of the request body for the script thread.
+    # a task on the loop keeps up to max_size bytes read ahead, then stops
+    # consuming the body, which lets tremolo throttle the client
+    def __init__(self, request, loop, max_size=1048576):
+        self.request = request
+        self.loop = loop
+        self.max_size = max_size
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._task = None
+        self._resume = None
+        self._eof = False
+        self._exc = None
+
+    def readable(self):
+        return True
+
+    async def _read_ahead(self):
+        self._resume = asyncio.Event()
+
+        try:
+            async for data in self.request.stream():
+                with self._cond:
+                    self._buf.extend(data)
+                    self._cond.notify()
+
+                    if len(self._buf) < self.max_size:
+                        continue
+
+                    self._resume.clear()
+
+                await self._resume.wait()
+        except BaseException as exc:
+            self._exc = exc
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify()
+
+    def readinto(self, b):
+        if self._task is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+
+            if loop is self.loop:
+                # would block the loop that has to deliver the data
+                raise RuntimeError(
+                    'cannot read request.stream synchronously in the event '
+                    'loop, use "async for data in request.stream()" instead'
+                )
+
+            self._task = asyncio.run_coroutine_threadsafe(self._read_ahead(),
+                                                          self.loop)
+
+        with self._cond:
+            while not self._buf and not self._eof:
+                self._cond.wait()
+
+            if not self._buf and self._exc is not None:
+                raise self._exc
+
+            size = min(len(b), len(self._buf))
+            b[:size] = self._buf[:size]
+            full = len(self._buf) >= self.max_size
+            del self._buf[:size]
+
+        if full:
+            self.loop.call_soon_threadsafe(self._resume.set)
+
+        return size
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+        super().close()
+
+
+class RequestStream(io.BufferedReader):
+    def __call__(self, *args, **kwargs):
+        # keeps "async for data in request.stream()" working
+        return self.raw.request.stream(*args, **kwargs)
+
+
+class ScriptStdin:
+    # sys.stdin of each script thread is the body of its own request,
+    # as text, with the binary request.stream as sys.stdin.buffer
+    def __init__(self, stdin):
+        self.stdin = stdin
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def get(self):
+        try:
+            return self.local.stdin
+        except AttributeError:
+            request = getattr(self.local, 'request', None)
+
+        if request is None:
+            return self.stdin
+
+        self.local.stdin = io.TextIOWrapper(request.stream, encoding='utf-8')
+        return self.local.stdin
+
+    def set(self, request=None):
+        self.local.__dict__.clear()
+
+        if request is not None:
+            self.local.request = request
+
+
+class Files(Coroutine):
+    # request.files() can be awaited, passed to wait(), or iterated over
+    # with "async for" to get the raw parts as in tremolo
+    def __init__(self, coro, parts):
+        self.coro = coro
+        self.parts = parts
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    def __aiter__(self):
+        self.coro.close()
+        return self.parts.__aiter__()
+
+    def send(self, value):
+        return self.coro.send(value)
+
+    def throw(self, *args):
+        return self.coro.throw(*args)
+
+    def close(self):
+        self.coro.close()
+
 
 class HTTPRequest:
     def __init__(self, request, environ):
         self.request = request
         self.environ = environ
+        self._stream = None
 
     def __getattr__(self, name):
         return getattr(self.request, name)
+
+    @property
+    def stream(self):
+        if self._stream is None:
+            options = self.request.server.options
+            self._stream = RequestStream(
+                RequestBody(self.request, self.request.server.loop,
+                            options['buffer_size'] * 64),
+                options['buffer_size'] * 4
+            )
+
+        return self._stream
+
+    def files(self, max_files=1024, *, max_file_size=100 * 1048576):
+        return Files(
+            self._parse_files(max_files, max_file_size),
+            self.request.files(max_files, max_file_size=max_file_size)
+        )
+
+    async def _parse_files(self, max_files, max_file_size):
+        params = self.request.params
+
+        if 'files' in params:
+            return params['files']
+
+        if b'multipart/form-data' not in self.request.headers.getlist(
+                b'content-type', b';'):
+            raise BadRequest('invalid Content-Type')
+
+        options = self.request.server.options
+        loop = self.request.server.loop
+        fields = params['post'] = {}
+        files = params['files'] = {}
+        upload = None
+
+        # the parts arrive in fragments of up to 4 * buffer_size bytes
+        async for part in self.request.files(
+                max_files, max_file_size=options['buffer_size'] * 4):
+            data = part.pop('data')
+
+            if upload is None:
+                upload = UploadFile(
+                    part.get('name', ''), part.get('filename'),
+                    part.get('type', 'application/octet-stream'),
+                    spool_size=options.get('upload_spool_size', 1024) * 1024,
+                    dir=options.get('upload_dir')
+                )
+
+                if upload.filename:
+                    files.setdefault(upload.name, []).append(upload)
+
+            if upload.size + len(data) > max_file_size:
+                raise PayloadTooLarge('file size limit reached')
+
+            if upload.filename is None and upload.spooled(len(data)):
+                raise PayloadTooLarge('field size limit reached')
+
+            if upload.spooled(len(data)):
+                # keeps the disk writes off the loop
+                await loop.run_in_executor(None, upload.write, data)
+            else:
+                upload.write(data)
+
+            if part['eof']:
+                if upload.filename is None:
+                    fields.setdefault(upload.name, []).append(
+                        upload.getvalue().decode()
+                    )
+
+                if upload.filename:
+                    upload.seek(0)
+                else:
+                    upload.close()
+
+                upload = None
+
+        return files
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+        # removes the uploaded files that have not been moved
+        for uploads in self.request.params.get('files', {}).values():
+            for upload in uploads:
+                if isinstance(upload, UploadFile):
+                    upload.close()
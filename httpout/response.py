@@ -2,10 +2,14 @@
 
 import asyncio
 import concurrent.futures
+import threading
 
 from traceback import TracebackException
 from tremolo.utils import html_escape
 
+# the size of the writes gathered by writelines()
+BATCH_SIZE = 65536
+
 
 class HTTPResponse:
     def __init__(self, response):
@@ -13,6 +17,31 @@ class HTTPResponse:
         self.loop = response.request.server.loop
         self.logger = response.request.server.logger
         self.tasks = set()
+        self.status = 200
+        self.size = 0
+
+        # print()s waiting to be written, bounded by max_buffer_size.
+        # a list of bytes, joined into a single write
+        self.buffer = []
+        self.pending = 0
+        self.max_buffer_size = response.request.server.options.get(
+            'max_write_buffer_size', 64
+        ) * 1024
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._flush_task = None
+        self._exc = None
+
+        # records the output for the coalesced requests, if any
+        self.flight = None
+
+        # see finish() and defer()
+        self.finished = False
+        self.deferred = []
+
+        # see Tracer
+        self.trace = None
+        self.server_timing = False
 
     def __getattr__(self, name):
         return getattr(self.response, name)
@@ -26,12 +55,215 @@ class HTTPResponse:
 
         self.tasks.add(task)
         task.add_done_callback(self.tasks.discard)
+        return task
+
+    def start_flush(self):
+        self._flush_task = self.create_task(self.flush())
 
     async def join(self):
+        # the flush and the run() coroutines
         while self.tasks:
             await self.tasks.pop()
 
+    async def wait_flushed(self):
+        # only the print()s so far, not the run() coroutines
+        while self._flush_task is not None and not self._flush_task.done():
+            await asyncio.wait((self._flush_task,))
+
+    async def wait_writable(self):
+        # waits until the output queue is taken by the transport,
+        # which pauses while it is above its high-water mark
+        protocol = self.protocol
+        delay = 0
+
+        while (protocol is not None and not protocol.is_closing() and
+                protocol.queue and protocol.queue[1].qsize()):
+            if ('send' in protocol.events and
+                    not protocol.events['send'].done()):
+                # resumed by protocol.resume_writing(), or cancelled on timeout
+                await asyncio.wait((protocol.events['send'],))
+                delay = 0
+            else:
+                # the queue is about to be taken, backs off if it is not
+                await asyncio.sleep(delay)
+                delay = min(delay * 2 or 0.001, 0.1)
+
+    async def drain(self):
+        await self.wait_flushed()
+
+        if self._exc is not None:
+            raise self._exc
+
+        await self.wait_writable()
+
+    async def flush(self):
+        # the only writer of self.buffer, so the order is preserved
+        while True:
+            with self._lock:
+                if not self.buffer or self._exc is not None:
+                    self._flushing = False
+                    return
+
+                chunks = self.buffer
+                self.buffer = []
+
+            # a single chunk is written as is, without a copy
+            data = b''.join(chunks)
+
+            try:
+                if self.response.request.upgraded:
+                    # e.g. WebSocket frames
+                    self.size += len(data)
+                    await self.response.send(data)
+                else:
+                    await self.write(data)
+
+                await self.wait_writable()
+            except BaseException as exc:
+                with self._lock:
+                    self._exc = exc
+                    self._flushing = False
+                    del self.buffer[:]
+                    self.pending = 0
+
+                raise
+            finally:
+                with self._lock:
+                    self.pending = max(self.pending - len(data), 0)
+
+    async def end(self):
+        # completes the response and frees the connection for the next
+        # keep-alive request, while the script may still be running
+        if self.finished or self.response.request.upgraded:
+            return
+
+        self.finished = True
+
+        await self.drain()
+        await self.write(b'')
+        self.response.close(keepalive=True)
+
+    def run_soon(self, coro):
+        # blocks in the script thread, on the loop the coroutine is returned
+        try:
+            if asyncio.get_running_loop() is self.loop:
+                return coro
+        except RuntimeError:
+            pass
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def finish(self):
+        # like fastcgi_finish_request(), the rest of the output is discarded
+        if self.finished:
+            return
+
+        return self.run_soon(self.end())
+
+    async def send_early_hints(self, links):
+        await self.wait_flushed()  # the print()s before it, if any
+
+        if (self.response.headers_sent() or
+                self.response.request.version != b'1.1'):
+            return False
+
+        if isinstance(links, str):
+            links = (links,)
+
+        data = bytearray(b'HTTP/1.1 103 Early Hints\r\n')
+
+        for link in links:
+            link = link.encode('latin-1')
+
+            if b'\r' in link or b'\n' in link:
+                raise ValueError('invalid Link header')
+
+            data.extend(b'Link: %s\r\n' % link)
+
+        await self.response.send(data + b'\r\n')
+        return True
+
+    def early_hints(self, links):
+        # e.g. '</style.css>; rel=preload; as=style', before the headers
+        return self.run_soon(self.send_early_hints(links))
+
+    async def send_headers(self):
+        await self.wait_flushed()
+
+        if self.finished or self.response.headers_sent():
+            return
+
+        if self.flight is not None:
+            self.flight.record(self.response, b'')
+
+        # what the first write() does, but write(b'') would also
+        # terminate a chunked body
+        await self.prepare_headers()
+
+        response = self.response
+        request = response.request
+        status = response.get_status()
+        no_content = status[0] in (204, 205, 304) or 100 <= status[0] < 200
+
+        response.set_base_headers()
+        response.set_status(*status)
+
+        if b'connection' not in response.headers:
+            if response.http_chunked is None:
+                response.http_chunked = (request.version == b'1.1' and
+                                         not no_content)
+
+            if not no_content:
+                response.set_header(b'Content-Type',
+                                    response.get_content_type())
+
+            if response.http_chunked:
+                response.set_header(b'Transfer-Encoding', b'chunked')
+
+            if request.method == b'HEAD' or no_content:
+                request.http_keepalive = False
+            elif not (response.http_chunked or
+                      b'content-length' in response.headers):
+                # no chunk, no size, the end is the close
+                request.http_keepalive = False
+
+            response.set_header(
+                b'Connection',
+                b'keep-alive' if request.http_keepalive else b'close'
+            )
+
+        headers = response.headers
+        line = headers.pop(b'_line')
+
+        await response.send(
+            b' '.join(line) + b'\r\n' +
+            b'\r\n'.join(b'\r\n'.join(v) for v in headers.values()) +
+            b'\r\n\r\n'
+        )
+        response.headers_sent(True)
+
+        if request.method == b'HEAD' or no_content:
+            # ended without a body
+            self.finished = True
+            response.close()
+
+    def flush_headers(self):
+        # sends the headers now, rather than on the first print()
+        return self.run_soon(self.send_headers())
+
+    def defer(self, func, *args, **kwargs):
+        # called in the background pool after the response has finished
+        self.deferred.append((func, args, kwargs))
+
     async def handle_exception(self, exc):
+        if self.finished:
+            # the connection may already be serving another request
+            if not isinstance(exc, SystemExit):
+                self.logger.error('%s after the response has finished: %s',
+                                  exc.__class__.__name__, exc, exc_info=exc)
+
+            return
+
         if self.protocol is None or self.protocol.transport is None:
             return
 
@@ -46,6 +278,7 @@ class HTTPResponse:
 
             if isinstance(exc, Exception):
                 if not self.response.headers_sent():
+                    self.status = 500
                     self.response.set_status(500, b'Internal Server Error')
                     self.response.set_content_type(b'text/html; charset=utf-8')
 
@@ -74,7 +307,11 @@ class HTTPResponse:
 
         async def callback():
             try:
-                result = await coro
+                if self.trace is None:
+                    result = await coro
+                else:
+                    with self.trace.span('run'):
+                        result = await coro
 
                 if not fut.done():
                     fut.set_result(result)
@@ -129,26 +366,108 @@ class HTTPResponse:
 
     def set_status(self, status=200, message='OK'):
         self.call_soon(self.response.set_status, status, message)
+        self.status = status
 
     def set_content_type(self, content_type='text/html; charset=utf-8'):
         self.call_soon(self.response.set_content_type, content_type)
 
     async def write(self, data, **kwargs):
+        if self.flight is not None:
+            self.flight.record(self.response, data)
+
         if not self.response.headers_sent():
-            await self.protocol.run_middlewares('response', reverse=True)
+            await self.prepare_headers()
 
+        self.size += len(data)
         await self.response.write(data, **kwargs)
 
+    async def prepare_headers(self):
+        if b'_line' in self.response.headers:
+            self.status = int(self.response.headers[b'_line'][1])
+
+        if self.server_timing and self.trace is not None:
+            # only the spans that have finished before the headers
+            self.response.append_header(b'Server-Timing',
+                                        self.trace.server_timing())
+
+        await self.protocol.run_middlewares('response', reverse=True)
+
     def print(self, *args, sep=' ', end='\n', **kwargs):
-        coro = self.write((sep.join(map(str, args)) + end).encode())
+        self.write_buffered((sep.join(map(str, args)) + end).encode())
+
+    def write_bytes(self, data):
+        # bytes are buffered as is, the other buffers, e.g. bytearray or
+        # memoryview, are copied once as the script may modify them later.
+        # memoryview() raises TypeError on the rest, bytes(3) would not
+        self.write_buffered(
+            data if isinstance(data, bytes) else bytes(memoryview(data))
+        )
+
+    def writelines(self, lines):
+        # like write_bytes(), gathered into fewer writes
+        chunks = []
+        size = 0
+
+        for data in lines:
+            if not isinstance(data, bytes):
+                data = bytes(memoryview(data))
+
+            chunks.append(data)
+            size += len(data)
+
+            if size >= BATCH_SIZE:
+                self.write_buffered(*chunks)
+                chunks.clear()
+                size = 0
+
+        if chunks:
+            self.write_buffered(*chunks)
+
+    def write_buffered(self, *chunks):
+        if self.finished:
+            return
+
+        if self._exc is not None:
+            # the previous write has failed, e.g. the client is gone
+            raise self._exc
+
+        size = sum(map(len, chunks))
+
+        if size == 0:
+            # write(b'') would end the response
+            return
+
+        with self._lock:
+            self.buffer.extend(chunks)
+            self.pending += size
+            flush = not self._flushing
+            self._flushing = True
 
         try:
             loop = asyncio.get_running_loop()
 
             if loop is self.loop:
-                self.create_task(coro)
+                if flush:
+                    self.start_flush()
+
                 return
         except RuntimeError:
             pass
 
-        self.loop.call_soon_threadsafe(self.create_task, coro)
+        if flush:
+            # before drain() below, the callbacks run in order
+            self.loop.call_soon_threadsafe(self.start_flush)
+
+        if self.pending > self.max_buffer_size:
+            # the client reads slower than the script writes, block until
+            # the buffered data has been handed over to the transport
+            timeout = self.protocol.options['keepalive_timeout']
+            fut = asyncio.run_coroutine_threadsafe(self.drain(), self.loop)
+
+            try:
+                fut.result(timeout)
+            except concurrent.futures.TimeoutError as exc:
+                fut.cancel()
+                raise TimeoutError(
+                    f'write buffer is not drained after {timeout}s'
+                ) from exc
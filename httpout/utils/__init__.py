@@ -1,8 +1,9 @@
 # Copyright (c) 2024 nggit
 
 __all__ = (
-    'WORD_CHARS', 'PATH_CHARS', 'is_safe_path',
-    'new_module', 'exec_module', 'cleanup_modules', 'mime_types'
+    'WORD_CHARS', 'PATH_CHARS', 'is_safe_path', 'resolve_path',
+    'find_module', 'new_module', 'exec_module', 'cleanup_modules',
+    'mime_types', 'SharedState'
 )
 
 import os  # noqa: E402
@@ -11,6 +12,7 @@ import sys  # noqa: E402
 from types import ModuleType  # noqa: E402
 
 from .modules import exec_module, cleanup_modules  # noqa: E402
+from .shared import SharedState  # noqa: E402
 
 # \w
 WORD_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_'
@@ -24,10 +26,71 @@ def is_safe_path(path):
     return True
 
 
-def new_module(name, level=0, document_root=None):
-    if document_root is None:
-        document_root = os.getcwd()
+def _resolve_path(path, path_info):
+    depth = 0
+    segments = []
+
+    for segment in path.split('/'):
+        if segment == '..':
+            depth -= 1
+
+            if depth < 0:
+                raise ValueError('Path traversal is not allowed')
+        elif segment not in ('', '.'):
+            depth += 1
+            segments.append(segment)
+
+    # the leading slash is optional in the request line, e.g. "GET .git"
+    if ('/.' in '/' + path.lstrip('/') and
+            not path.startswith('/.well-known/')):
+        raise ValueError('Access to dotfiles is prohibited')
+
+    if not is_safe_path(path):
+        raise ValueError('Unsafe URL detected')
+
+    if path_info:
+        path_info = os.path.normpath(path_info).replace(os.sep, '/')
+
+    return segments, path_info
+
+
+def resolve_path(path):
+    # splits a URL path, e.g. "/foo/bar.py/baz",
+    # into (['foo', 'bar.py'], '/baz', '.py')
+    # raises ValueError if it is not safe to be mapped to the document root
+    i = path.find('.py/')
+
+    if i == -1:
+        path_info = ''
+    else:
+        path_info = path[i + 3:]
+        path = path[:i + 3]
+
+    # fast path: already normalized, no empty or dot-leading segments
+    if (path.startswith('/') and '/.' not in path and '//' not in path and
+            is_safe_path(path) and
+            (len(path_info) < 2 or not (path_info.endswith('/') or
+                                        '/.' in path_info or
+                                        '//' in path_info))):
+        segments = path[1:].split('/')
 
+        if segments[-1] == '':
+            segments.pop()
+    else:
+        segments, path_info = _resolve_path(path, path_info)
+
+    if segments:
+        # the same as os.path.splitext(segments[-1])[-1]
+        name = segments[-1]
+        i = name.rfind('.')
+
+        if i > 0 and name[:i].lstrip('.'):
+            return segments, path_info, name[i:]
+
+    return segments, path_info, ''
+
+
+def find_module(name, document_root):
     module_path = os.path.join(
         document_root,
         name.replace('.', os.sep), '__init__.py'
@@ -39,6 +102,16 @@ def new_module(name, level=0, document_root=None):
         )
 
     if os.path.isfile(module_path):
+        return module_path
+
+
+def new_module(name, level=0, document_root=None):
+    if document_root is None:
+        document_root = os.getcwd()
+
+    module_path = find_module(name, document_root)
+
+    if module_path:
         if name in sys.modules:
             if ('__file__' in sys.modules[name].__dict__ and
                     sys.modules[name].__file__.startswith(document_root)):
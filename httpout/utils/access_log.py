@@ -0,0 +1,88 @@
+# Copyright (c) 2024 nggit
+
+import json
+import logging
+import queue
+
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_FORMAT = (
+    '%(asctime)s %(remote_addr)s "%(method)s %(uri)s HTTP/%(version)s" '
+    '%(status)d %(size)d %(duration).3fms "%(user_agent)s"'
+)
+FIELDS = ('remote_addr', 'method', 'uri', 'version', 'status', 'size',
+          'duration', 'script', 'user_agent')
+
+
+class AccessLogFormatter(logging.Formatter):
+    def format(self, record):
+        # the raw values are decoded here, in the listener thread
+        for name in FIELDS:
+            value = getattr(record, name)
+
+            if isinstance(value, bytes):
+                setattr(record, name, value.decode('latin-1'))
+
+        return super().format(record)
+
+
+class JSONFormatter(AccessLogFormatter):
+    def format(self, record):
+        super().format(record)
+
+        data = {'time': self.formatTime(record)}
+        data.update((name, getattr(record, name)) for name in FIELDS)
+
+        return json.dumps(data)
+
+
+class LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # the default prepare() formats the record in the calling thread
+        return record
+
+
+class AccessLog:
+    def __init__(self, filename=None, fmt=DEFAULT_FORMAT, json=False):
+        if filename is None:
+            self.handler = logging.StreamHandler()
+        else:
+            self.handler = logging.FileHandler(filename, delay=True)
+
+        if json:
+            self.handler.setFormatter(JSONFormatter())
+        else:
+            self.handler.setFormatter(AccessLogFormatter(fmt))
+
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = LazyQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, self.handler)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+        self.handler.close()
+
+    def log(self, request, status, size, duration, script='-'):
+        # a repeated header is a list
+        user_agent = request.headers.get(b'user-agent')
+
+        record = logging.makeLogRecord({
+            'name': 'httpout.access',
+            'levelno': logging.INFO,
+            'levelname': 'INFO',
+            'msg': 'access',
+            'remote_addr': request.ip,
+            'method': request.method,
+            'uri': request.url,
+            'version': request.version,
+            'status': status,
+            'size': size,
+            'duration': duration * 1000,  # in milliseconds
+            'script': script,
+            'user_agent': (user_agent if isinstance(user_agent, bytes)
+                           else b'-')
+        })
+        self.queue_handler.handle(record)
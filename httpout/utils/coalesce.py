@@ -0,0 +1,120 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+
+DEFAULT_HEADERS = (b'accept', b'accept-encoding', b'accept-language')
+
+
+class Flight:
+    # the output of a script execution, recorded for the identical
+    # requests waiting for it
+    def __init__(self, loop, max_size):
+        self.done = loop.create_future()
+        self.max_size = max_size
+        self.headers = None
+        self.body = []
+        self.size = 0
+        self.shareable = True
+        self.followers = 0
+
+    def record(self, response, data):
+        if not self.shareable:
+            return
+
+        if self.headers is None:
+            if response.headers_sent():  # e.g. by handle_exception()
+                self.shareable = False
+                return
+
+            self.headers = {k: list(v) for k, v in response.headers.items()}
+
+        if not data:
+            # e.g. the headers only, or the end of the response,
+            # which would end the response of the followers too early
+            return
+
+        self.size += len(data)
+
+        if self.size > self.max_size:
+            self.shareable = False
+            self.body.clear()
+        else:
+            self.body.append(data)
+
+    def finish(self, response, shareable=True):
+        if self.headers is None and not response.headers_sent():
+            # no writes, e.g. only a status
+            self.headers = {k: list(v) for k, v in response.headers.items()}
+
+        # a cookie is never shared with the other clients
+        self.shareable = (self.shareable and shareable and
+                          self.headers is not None and
+                          b'set-cookie' not in self.headers)
+
+        if not self.shareable:
+            self.body.clear()
+
+        if not self.done.done():
+            self.done.set_result(self.shareable)
+
+
+class Coalescer:
+    # single-flight: identical concurrent GET / HEAD requests to the
+    # opted-in scripts share one execution. only used from the event loop
+    def __init__(self, loop, paths, headers=DEFAULT_HEADERS,
+                 max_size=1048576):
+        self.loop = loop
+        self.paths = tuple(paths)  # SCRIPT_NAMEs, or prefixes ending in "/"
+        self.headers = tuple(headers)
+        self.max_size = max_size
+        self.flights = {}
+
+    def accepts(self, request, script_name):
+        if (request.method not in (b'GET', b'HEAD') or
+                b'cookie' in request.headers or
+                b'authorization' in request.headers):
+            return False
+
+        for path in self.paths:
+            if script_name == path or (path.endswith('/') and
+                                       script_name.startswith(path)):
+                return True
+
+        return False
+
+    def key(self, request, module_path):
+        return (request.method, request.host, request.url, module_path,
+                *(request.headers.get(name) for name in self.headers))
+
+    def join(self, key):
+        # returns (flight, True) for the first request, which runs the script
+        flight = self.flights.get(key)
+
+        if flight is None:
+            flight = self.flights[key] = Flight(self.loop, self.max_size)
+            return flight, True
+
+        flight.followers += 1
+        return flight, False
+
+    def finish(self, key, flight, response, shareable=True):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+        flight.finish(response, shareable)
+
+    async def replay(self, flight, response):
+        # response is an HTTPResponse of a waiting request
+        if not await asyncio.shield(flight.done):
+            return False
+
+        headers = response.response.headers
+        headers.update({k: list(v) for k, v in flight.headers.items()})
+
+        if b'_line' in headers:
+            headers[b'_line'][0] = b'HTTP/%s' % response.request.version
+
+        for data in flight.body:
+            await response.write(data)
+
+        return True
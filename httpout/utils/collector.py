@@ -0,0 +1,97 @@
+# Copyright (c) 2024 nggit
+
+import gc
+import time
+
+from time import perf_counter
+
+from .metrics import Histogram
+
+POLICIES = ('default', 'idle')
+
+# in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1)
+
+
+class Collector:
+    # the "idle" policy: young collections are made rarer and full ones
+    # are deferred while scripts are running, then done when the worker
+    # is idle, or after max_interval seconds of being busy
+    def __init__(self, loop, is_idle, policy='default', interval=1,
+                 max_interval=30, young_threshold=10000, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError(f'unknown GC policy: {policy}')
+
+        self.loop = loop
+        self.is_idle = is_idle
+        self.policy = policy
+        self.interval = interval
+        self.max_interval = max_interval
+        self.young_threshold = young_threshold
+        self.metrics = metrics
+        self.histograms = {}
+        self.collected_at = time.monotonic()
+        self._threshold = None
+        self._started = None
+
+    def start(self):
+        if self.metrics is not None:
+            for generation in range(3):
+                # observed without the lock of Metrics, in case a collection
+                # is triggered while the lock is held
+                self.histograms[generation] = Histogram(BUCKETS)
+                self.metrics.set('httpout_gc_pause_seconds',
+                                 self.histograms[generation],
+                                 generation=generation)
+
+            gc.callbacks.append(self.on_collect)
+
+        if self.policy == 'idle':
+            # the worker is set up, none of it will be garbage
+            gc.freeze()
+
+            self._threshold = gc.get_threshold()
+            gc.set_threshold(max(self._threshold[0], self.young_threshold),
+                             self._threshold[1], 2 ** 31 - 1)
+
+    def stop(self):
+        if self.on_collect in gc.callbacks:
+            gc.callbacks.remove(self.on_collect)
+
+        if self._threshold is not None:
+            gc.set_threshold(*self._threshold)
+            self._threshold = None
+
+    def on_collect(self, phase, info):
+        # called by any thread that triggers a collection, with the GIL
+        if phase == 'start':
+            self._started = perf_counter()
+        elif self._started is not None:
+            self.histograms[info['generation']].observe(
+                perf_counter() - self._started
+            )
+            self._started = None
+
+    def request_done(self):
+        # called from the event loop at the end of each script request
+        if self.policy != 'idle':
+            return
+
+        elapsed = time.monotonic() - self.collected_at
+
+        if elapsed >= self.max_interval:
+            # busy for too long, the memory must not grow without bounds
+            self.collect()
+        elif elapsed >= self.interval and self.is_idle():
+            # after the response has been sent
+            self.loop.call_soon(self.collect_idle)
+
+    def collect_idle(self):
+        if (self.is_idle() and
+                time.monotonic() - self.collected_at >= self.interval):
+            self.collect()
+
+    def collect(self):
+        self.collected_at = time.monotonic()
+        gc.collect()
@@ -0,0 +1,86 @@
+# Copyright (c) 2024 nggit
+
+import os
+import time
+
+
+class Generation:
+    def __init__(self, number, root, imports):
+        self.number = number
+        self.root = root
+        self.imports = imports
+        self.requests = 0  # in flight
+
+    def __repr__(self):
+        return f'<Generation {self.number}: {self.root}>'
+
+
+class Deploys:
+    # follows the document root when it is a symlink swapped on deploy,
+    # e.g. current -> releases/N. each request is pinned to the generation
+    # it started with, the older ones are retired once they are idle.
+    # only used from the event loop
+    def __init__(self, document_root, factory, *, interval=None,
+                 on_change=None, on_retire=None):
+        self.document_root = document_root
+        self.factory = factory  # root -> ImportGraph
+        self.interval = interval  # None: the root is never resolved again
+        self.on_change = on_change
+        self.on_retire = on_retire
+        self.generations = []  # the last one is the current one
+        self.checked_at = 0
+
+    def current(self):
+        now = time.monotonic()
+
+        if self.generations and (self.interval is None or
+                                 now - self.checked_at < self.interval):
+            return self.generations[-1]
+
+        self.checked_at = now
+
+        if self.interval is None:
+            root = self.document_root
+        else:
+            root = os.path.realpath(self.document_root)
+
+        if self.generations and self.generations[-1].root == root:
+            return self.generations[-1]
+
+        generation = Generation(
+            self.generations[-1].number + 1 if self.generations else 1,
+            root,
+            self.factory(root)
+        )
+        self.generations.append(generation)
+
+        if generation.number > 1 and self.on_change is not None:
+            self.on_change(generation, self.generations[-2])
+
+        self.retire()
+        return generation
+
+    def acquire(self):
+        generation = self.current()
+        generation.requests += 1
+
+        return generation
+
+    def release(self, generation):
+        generation.requests -= 1
+
+        if generation is not self.generations[-1]:
+            self.retire()
+
+    def retire(self):
+        for generation in self.generations[:-1]:
+            if generation.requests > 0:
+                continue
+
+            self.generations.remove(generation)
+
+            if self.on_retire is not None:
+                self.on_retire(generation)
+
+    def is_live(self, root):
+        return any(generation.root == root for generation in self.generations)
@@ -0,0 +1,76 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+
+
+class Hub:
+    # a worker-level pub/sub of websockets, e.g. from httpout import hub.
+    # a message is framed once, then put on the output queue of each
+    # subscriber in a single callback on the loop
+    def __init__(self, loop, logger=None):
+        self.loop = loop
+        self.logger = logger
+        self.channels = {}
+
+    def call_soon(self, func, *args):
+        try:
+            if asyncio.get_running_loop() is self.loop:
+                func(*args)
+                return
+        except RuntimeError:
+            pass
+
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def subscribe(self, websocket, channel=''):
+        self.call_soon(self._subscribe, websocket, channel)
+
+    def unsubscribe(self, websocket, channel=None):
+        self.call_soon(self._unsubscribe, websocket, channel)
+
+    def publish(self, message, channel=''):
+        self.call_soon(self._publish, message, channel)
+
+    def _subscribe(self, websocket, channel):
+        self.channels.setdefault(channel, set()).add(websocket)
+
+    def _unsubscribe(self, websocket, channel):
+        for name in list(self.channels if channel is None else (channel,)):
+            subscribers = self.channels.get(name)
+
+            if subscribers is not None:
+                subscribers.discard(websocket)
+
+                if not subscribers:
+                    del self.channels[name]
+
+    def _publish(self, message, channel):
+        subscribers = self.channels.get(channel)
+
+        if not subscribers:
+            return
+
+        from tremolo.lib.websocket import WebSocket
+
+        frame = WebSocket.create_frame(message)
+
+        for websocket in list(subscribers):
+            protocol = websocket.request.server
+
+            if not websocket.request.upgraded:
+                # not accepted yet
+                continue
+
+            if (protocol.queue and protocol.queue[1].qsize() <
+                    protocol.options['max_queue_size']):
+                websocket.response.send_nowait(frame)
+                continue
+
+            # gone or too slow, the other subscribers are not held back
+            self._unsubscribe(websocket, None)
+
+            if protocol.queue:
+                if self.logger is not None:
+                    self.logger.info('hub: dropping a slow subscriber')
+
+                protocol.close()
@@ -0,0 +1,167 @@
+# Copyright (c) 2024 nggit
+
+import ast
+import os
+import threading
+
+from . import find_module
+
+
+class ImportGraph:
+    # the compiled modules of the document root and their local imports,
+    # found by parsing the source instead of waiting for ho_import
+    def __init__(self, document_root, max_size=8 * 1048576, on_change=None):
+        self.document_root = document_root
+        self.max_size = max_size
+        self.on_change = on_change
+        self.modules = {}  # path: (mtime_ns, size), code, {dependency paths}
+        self._lock = threading.Lock()
+
+    def module_name(self, path):
+        name = os.path.splitext(path[len(self.document_root):].lstrip(os.sep))
+
+        if os.path.basename(name[0]) == '__init__':
+            return os.path.dirname(name[0]).replace(os.sep, '.')
+
+        return name[0].replace(os.sep, '.')
+
+    def find_imports(self, tree, name):
+        names = set()
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    names.add(alias.name)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ''
+
+                if node.level > 0:
+                    # resolved the same way as ho_import does
+                    parent = name.rsplit('.', node.level)[0]
+                    base = f'{parent}.{base}' if base else parent
+
+                names.add(base)
+
+                # the names can be submodules
+                for alias in node.names:
+                    if alias.name != '*':
+                        names.add(f'{base}.{alias.name}')
+
+        paths = set()
+
+        for name in names:
+            parts = name.split('.')
+
+            # importing a.b.c also imports a and a.b
+            for i in range(1, len(parts) + 1):
+                path = find_module('.'.join(parts[:i]), self.document_root)
+
+                if path:
+                    paths.add(path)
+
+        return paths
+
+    def load(self, path):
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        entry = self.modules.get(path)
+
+        if entry is not None:
+            if entry[0] == version:
+                return entry
+
+            # modified, the dependents may hold a stale code cache
+            dependents = self.invalidate(path)
+
+            if self.on_change is not None:
+                self.on_change(path, dependents)
+
+        if st.st_size > self.max_size:
+            raise ValueError(f'File {path} exceeds the max_size')
+
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read(), path)
+
+        entry = (version, compile(tree, path, 'exec'),
+                 self.find_imports(tree, self.module_name(path)))
+        entry[2].discard(path)
+
+        with self._lock:
+            self.modules[path] = entry
+
+        return entry
+
+    def get_code(self, path):
+        # compiled once, then reused until the file is modified
+        return self.load(path)[1]
+
+    def analyze(self, path):
+        # compiles the whole import graph of path ahead of time,
+        # returns the paths of its dependencies
+        seen = set()
+        paths = [path]
+        root = path
+
+        while paths:
+            path = paths.pop()
+
+            if path in seen:
+                continue
+
+            seen.add(path)
+
+            try:
+                paths.extend(self.load(path)[2])
+            except (OSError, SyntaxError, ValueError):
+                # left to ho_import to report at the import site
+                continue
+
+        seen.discard(root)
+        return seen
+
+    def walk(self):
+        for dirpath, dirnames, filenames in os.walk(self.document_root):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.') and
+                           name != '__pycache__']
+
+            for filename in filenames:
+                if filename.endswith('.py'):
+                    yield os.path.join(dirpath, filename)
+
+    def preload(self, paths=None):
+        # compiles the given modules, or every module of the document root,
+        # e.g. before forking
+        for path in (self.walk() if paths is None else paths):
+            try:
+                self.load(path)
+            except (OSError, SyntaxError, ValueError):
+                continue
+
+        return len(self.modules)
+
+    def dependents(self, path):
+        # the modules that import path, directly or not
+        result = set()
+        paths = [path]
+
+        while paths:
+            path = paths.pop()
+
+            for name, entry in list(self.modules.items()):
+                if path in entry[2] and name not in result:
+                    result.add(name)
+                    paths.append(name)
+
+        return result
+
+    def invalidate(self, path):
+        with self._lock:
+            self.modules.pop(path, None)
+
+        return self.dependents(path)
+
+    def as_dict(self):
+        return {
+            path: sorted(entry[2]) for path, entry in self.modules.items()
+        }
@@ -0,0 +1,155 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+import gc
+import os
+import threading
+import tracemalloc
+
+# the allocations of the tracking itself
+FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<unknown>')
+)
+
+
+class Route:
+    __slots__ = ('samples', 'size', 'retained', 'count', 'sites')
+
+    def __init__(self):
+        self.samples = 0
+        self.size = 0  # still allocated at the end of the request
+        self.retained = 0  # still allocated a while after, past a collection
+        self.count = 0  # objects
+        self.sites = {}  # 'file:lineno': retained
+
+
+class MemoryTracker:
+    # attributes the memory left allocated by the sampled requests to their
+    # SCRIPT_NAME by comparing tracemalloc snapshots. other requests running
+    # at the same time are included, so it needs enough samples
+    def __init__(self, executor, logger, rate=100, delay=1, limit=10):
+        if rate < 1:
+            raise ValueError(f'invalid sample rate: {rate}')
+
+        self.executor = executor  # takes the snapshots
+        self.logger = logger
+        self.rate = rate  # samples 1 in every rate requests
+        self.delay = delay
+        self.limit = limit
+        self.requests = 0
+        self.routes = {}
+        self.tasks = set()
+        self._lock = threading.Lock()
+
+    def start(self, frames=1):
+        tracemalloc.start(frames)
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+        tracemalloc.stop()
+
+    async def sample(self):
+        # returns a snapshot for 1 in every rate requests, or None.
+        # only called from the event loop
+        self.requests += 1
+
+        if self.requests % self.rate == 0:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.snapshot
+            )
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(FILTERS)
+
+    def track(self, script_name, before):
+        # after the request, doesn't wait for it
+        task = asyncio.get_running_loop().create_task(
+            self._track(script_name, before)
+        )
+
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _track(self, script_name, before):
+        loop = asyncio.get_running_loop()
+        after = await loop.run_in_executor(self.executor, self.snapshot)
+
+        await asyncio.sleep(self.delay)
+        size = await loop.run_in_executor(
+            self.executor, self.record, script_name, before, after
+        )
+        self.logger.debug('%s: %d bytes retained', script_name, size)
+
+    def compare(self, snapshot, before):
+        size = 0
+        count = 0
+        sites = {}
+
+        for stat in snapshot.compare_to(before, 'lineno'):
+            size += stat.size_diff
+            count += stat.count_diff
+
+            if stat.size_diff > 0:
+                frame = stat.traceback[0]
+                sites[f'{frame.filename}:{frame.lineno}'] = stat.size_diff
+
+        return size, count, sites
+
+    def record(self, script_name, before, after):
+        # runs in a background thread, a while after the request
+        gc.collect()
+        size, count, sites = self.compare(self.snapshot(), before)
+
+        with self._lock:
+            route = self.routes.get(script_name)
+
+            if route is None:
+                route = self.routes[script_name] = Route()
+
+            route.samples += 1
+            route.size += self.compare(after, before)[0]
+            route.retained += size
+            route.count += count
+
+            for site, value in sites.items():
+                route.sites[site] = route.sites.get(site, 0) + value
+
+        return size
+
+    def render(self, document_root=''):
+        with self._lock:
+            routes = sorted(
+                self.routes.items(),
+                key=lambda item: item[1].retained / item[1].samples,
+                reverse=True
+            )[:self.limit]
+            lines = [
+                f'# {self.requests} requests, sampled 1 in {self.rate}',
+                '# script samples avg_size avg_retained avg_objects'
+            ]
+
+            for script_name, route in routes:
+                lines.append('%s %d %d %d %d' % (
+                    script_name, route.samples, route.size // route.samples,
+                    route.retained // route.samples,
+                    route.count // route.samples
+                ))
+
+            for script_name, route in routes:
+                lines.append('')
+                lines.append(f'# {script_name} top allocation sites')
+
+                for site, value in sorted(route.sites.items(),
+                                          key=lambda item: item[1],
+                                          reverse=True)[:self.limit]:
+                    if document_root and site.startswith(document_root):
+                        site = site[len(document_root):].lstrip(os.sep)
+
+                    lines.append('%s %d' % (site, value // route.samples))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,134 @@
+# Copyright (c) 2024 nggit
+
+import threading
+
+# in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape_label(value):
+    return (str(value).replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in labels
+    )
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+
+            yield f'{name}_bucket', labels + (('le', bound),), total
+
+        yield f'{name}_bucket', labels + (('le', '+Inf'),), self.count
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, name, kind, description, func=None):
+        if name not in self.metrics:
+            self.metrics[name] = {
+                'type': kind,
+                'help': description,
+                'func': func,
+                'values': {}
+            }
+
+    def counter(self, name, description=''):
+        self._add(name, 'counter', description)
+
+    def gauge(self, name, description='', func=None):
+        self._add(name, 'gauge', description, func)
+
+    def histogram(self, name, description=''):
+        self._add(name, 'histogram', description)
+
+    def inc(self, name, value=1, **labels):
+        values = self.metrics[name]['values']
+        key = tuple(labels.items())
+
+        with self.lock:
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        self.metrics[name]['values'][tuple(labels.items())] = value
+
+    def observe(self, name, value, **labels):
+        values = self.metrics[name]['values']
+        key = tuple(labels.items())
+
+        with self.lock:
+            if key not in values:
+                values[key] = Histogram(self.buckets)
+
+            values[key].observe(value)
+
+    def render(self):
+        lines = []
+
+        for name, metric in self.metrics.items():
+            if metric['func'] is not None:
+                metric['values'][()] = metric['func']()
+
+            if metric['help']:
+                lines.append(f'# HELP {name} {metric["help"]}')
+
+            lines.append(f'# TYPE {name} {metric["type"]}')
+
+            with self.lock:
+                items = list(metric['values'].items())
+
+            for labels, value in items:
+                if isinstance(value, Histogram):
+                    samples = value.samples(name, labels)
+                else:
+                    samples = ((name, labels, value),)
+
+                for sample_name, sample_labels, sample_value in samples:
+                    lines.append(
+                        f'{sample_name}{format_labels(sample_labels)} '
+                        f'{format_value(sample_value)}'
+                    )
+
+        lines.append('')
+        return '\n'.join(lines)
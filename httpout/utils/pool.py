@@ -0,0 +1,165 @@
+# Copyright (c) 2024 nggit
+
+import threading
+import time
+
+from collections import deque
+
+
+class ResourcePool:
+    def __init__(self, factory, *, max_size=10, idle_timeout=60,
+                 check=None, close=None, logger=None):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check = check
+        self.logger = logger
+        self.size = 0  # idle + checked out
+
+        if close is not None:
+            self.close_resource = close
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+
+    def close_resource(self, resource):
+        close = getattr(resource, 'close', None)
+
+        if callable(close):
+            close()
+
+    def _discard(self, resource):
+        try:
+            self.close_resource(resource)
+        except Exception as exc:
+            if self.logger is not None:
+                self.logger.error('pool: failed to close %r: %s',
+                                  resource, exc)
+        finally:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+
+    def evict(self):
+        expired = []
+
+        with self._cond:
+            deadline = time.monotonic() - self.idle_timeout
+
+            # the oldest ones are on the left
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.popleft()[0])
+
+        for resource in expired:
+            self._discard(resource)
+
+    def acquire(self, timeout=None):
+        if self.idle_timeout is not None:
+            self.evict()
+
+        while True:
+            with self._cond:
+                while not self._idle and self.size >= self.max_size:
+                    if not self._cond.wait(timeout):
+                        raise TimeoutError(
+                            f'no resources available after {timeout}s '
+                            f'(max_size={self.max_size})'
+                        )
+
+                if not self._idle:
+                    self.size += 1
+                    break
+
+                # most recently used, most likely to be healthy
+                resource = self._idle.pop()[0]
+
+            if self.check is None:
+                return resource
+
+            try:
+                if self.check(resource) is not False:
+                    return resource
+            except Exception as exc:
+                if self.logger is not None:
+                    self.logger.info('pool: health check failed: %s', exc)
+
+            self._discard(resource)
+
+        try:
+            return self.factory()
+        except BaseException:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+
+            raise
+
+    def release(self, resource):
+        with self._cond:
+            self._idle.append((resource, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            idle = [resource for resource, _ in self._idle]
+            self._idle.clear()
+
+        for resource in idle:
+            self._discard(resource)
+
+
+class Pool:
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.pools = {}
+
+    def __contains__(self, name):
+        return name in self.pools
+
+    def register(self, name, factory, **kwargs):
+        if name in self.pools:
+            raise ValueError(f'pool {name!r} is already registered')
+
+        kwargs.setdefault('logger', self.logger)
+        self.pools[name] = ResourcePool(factory, **kwargs)
+
+    def acquire(self, name, timeout=None):
+        try:
+            return self.pools[name].acquire(timeout)
+        except KeyError as exc:
+            raise LookupError(f'pool {name!r} is not registered') from exc
+
+    def release(self, name, resource):
+        self.pools[name].release(resource)
+
+    def close(self):
+        while self.pools:
+            self.pools.popitem()[1].close()
+
+
+class PoolSession:
+    # a request-scoped view of the Pool.
+    # checked out resources are released at the end of the request
+    def __init__(self, pool):
+        self.pool = pool
+        self.resources = []
+
+    def get(self, name, timeout=None):
+        resource = self.pool.acquire(name, timeout)
+        self.resources.append((name, resource))
+
+        return resource
+
+    def release(self, resource):
+        for i, (name, value) in enumerate(self.resources):
+            if value is resource:
+                del self.resources[i]
+                self.pool.release(name, resource)
+                break
+
+    def release_all(self):
+        while self.resources:
+            self.pool.release(*self.resources.pop())
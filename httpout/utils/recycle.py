@@ -0,0 +1,71 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+import random
+import sys
+import time
+
+# a non-zero exit code makes tremolo start a new worker in its place
+EXIT_CODE = 4
+
+
+class Recycler:
+    # replaces the worker after max_requests, give or take the jitter,
+    # so that the workers don't all restart at the same time
+    def __init__(self, loop, logger, is_idle, max_requests, jitter=0,
+                 timeout=30):
+        self.loop = loop
+        self.logger = logger
+        self.is_idle = is_idle
+        self.max_requests = (
+            max_requests + random.randint(0, jitter)  # nosec B311
+        )
+        self.timeout = timeout
+        self.requests = 0
+        self.task = None
+
+    def count(self, request):
+        # only called from the event loop, at the start of each request
+        self.requests += 1
+
+        if self.requests < self.max_requests:
+            return
+
+        # the client should open its next connection to another worker
+        request.http_keepalive = False
+
+        if self.task is None:
+            # the listening server of the worker, on the asyncio event loops
+            server = getattr(request.protocol.transport, '_server', None)
+            self.task = self.loop.create_task(self.drain(server))
+            # SystemExit still leaves the event loop, but it is retrieved
+            # here so it isn't logged as never retrieved
+            self.task.add_done_callback(self.done)
+
+    def done(self, task):
+        if not task.cancelled():
+            task.exception()
+
+    async def drain(self, server=None):
+        self.logger.info('max requests reached (%d), restarting the worker',
+                         self.requests)
+
+        if server is not None:
+            # with SO_REUSEPORT, the new connections go to the other workers
+            server.close()
+
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            await asyncio.sleep(0.1)
+
+            if self.is_idle():
+                break
+
+            if time.monotonic() > deadline:
+                self.logger.error('requests still running after %gs',
+                                  self.timeout)
+                break
+
+        # like --limit-memory, the rest of the shutdown is done by tremolo
+        sys.exit(EXIT_CODE)
@@ -0,0 +1,203 @@
+# Copyright (c) 2024 nggit
+
+import mmap
+import multiprocessing as mp
+import os
+import struct
+
+from zlib import crc32
+
+SLOT_SIZE = 128
+KEY_SIZE = 60
+VALUE_SIZE = 64
+
+# slot types
+EMPTY = 0
+DELETED = 1
+INT = 2
+FLOAT = 3
+BYTES = 4
+STR = 5
+
+# type (1), key length (1), value length (2), key (60), value (64)
+SLOT = struct.Struct('<BBH%ds%ds' % (KEY_SIZE, VALUE_SIZE))
+INT64 = struct.Struct('<q')
+FLOAT64 = struct.Struct('<d')
+
+
+class SharedState:
+    def __init__(self, size=65536, *, path=None, lock=None):
+        if size < SLOT_SIZE:
+            raise ValueError(f'size must be at least {SLOT_SIZE} bytes')
+
+        self.size = size - size % SLOT_SIZE
+        self.slots = self.size // SLOT_SIZE
+        self.lock = lock or mp.Lock()
+        self._owner = path is None
+
+        if path is None:
+            import tempfile
+
+            fd, path = tempfile.mkstemp(prefix='httpout-', suffix='.shm')
+
+            try:
+                os.ftruncate(fd, self.size)
+            finally:
+                os.close(fd)
+
+        self.path = path
+
+        with open(path, 'r+b') as f:
+            self._mm = mmap.mmap(f.fileno(), self.size)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(size={self.size})'
+
+    def __getstate__(self):
+        # only happens when spawning a worker process
+        return {'size': self.size, 'path': self.path, 'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._find(key)[1] != -1
+
+    def __getitem__(self, key):
+        with self.lock:
+            offset = self._find(key)[1]
+
+            if offset == -1:
+                raise KeyError(key)
+
+            return self._read(offset)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+    def _find(self, key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+
+        if not isinstance(key, bytes) or not 0 < len(key) <= KEY_SIZE:
+            raise ValueError(f'key must be 1 to {KEY_SIZE} bytes in length')
+
+        # returns (key, offset of the key or -1, offset of a free slot or -1)
+        free = -1
+        index = crc32(key) % self.slots
+
+        for _ in range(self.slots):
+            offset = index * SLOT_SIZE
+            kind, key_size = self._mm[offset], self._mm[offset + 1]
+
+            if kind == EMPTY:
+                if free == -1:
+                    free = offset
+
+                break
+
+            if kind == DELETED:
+                if free == -1:
+                    free = offset
+            elif self._mm[offset + 4:offset + 4 + key_size] == key:
+                return key, offset, free
+
+            index = (index + 1) % self.slots
+
+        return key, -1, free
+
+    def _read(self, offset):
+        kind, _, size, _, value = SLOT.unpack_from(self._mm, offset)
+
+        if kind == INT:
+            return INT64.unpack_from(value)[0]
+
+        if kind == FLOAT:
+            return FLOAT64.unpack_from(value)[0]
+
+        if kind == STR:
+            return value[:size].decode('utf-8')
+
+        return value[:size]
+
+    def _write(self, key, offset, free, value):
+        if isinstance(value, int):
+            kind, value = INT, INT64.pack(value)
+        elif isinstance(value, float):
+            kind, value = FLOAT, FLOAT64.pack(value)
+        elif isinstance(value, str):
+            kind, value = STR, value.encode('utf-8')
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            kind, value = BYTES, bytes(value)
+        else:
+            raise TypeError(
+                f'unsupported type: {value.__class__.__name__}. '
+                'expected int, float, str or bytes'
+            )
+
+        if len(value) > VALUE_SIZE:
+            raise ValueError(f'value exceeds {VALUE_SIZE} bytes in length')
+
+        if offset == -1:
+            if free == -1:
+                raise MemoryError('shared memory is full')
+
+            offset = free
+
+        SLOT.pack_into(self._mm, offset,
+                       kind, len(key), len(value), key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self._write(*self._find(key), value)
+
+    def incr(self, key, value=1):
+        with self.lock:
+            key, offset, free = self._find(key)
+
+            if offset != -1:
+                current = self._read(offset)
+
+                if not isinstance(current, (int, float)):
+                    raise TypeError(f'{key!r} is not a number')
+
+                value += current
+
+            self._write(key, offset, free, value)
+            return value
+
+    def decr(self, key, value=1):
+        return self.incr(key, -value)
+
+    def delete(self, key):
+        with self.lock:
+            offset = self._find(key)[1]
+
+            if offset == -1:
+                return False
+
+            self._mm[offset] = DELETED
+            return True
+
+    def close(self):
+        if self._mm.closed:
+            return
+
+        self._mm.close()
+
+        if self._owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
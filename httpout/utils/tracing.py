@@ -0,0 +1,209 @@
+# Copyright (c) 2024 nggit
+
+import json
+import logging
+import queue
+import random
+import time
+
+from contextvars import ContextVar
+from logging.handlers import QueueListener
+from time import perf_counter
+
+from .access_log import LazyQueueHandler
+
+# the trace of the script running in the current thread, if any
+current_trace = ContextVar('current_trace', default=None)
+
+
+def new_id(bits=64):
+    # identifiers, not secrets
+    return '%0*x' % (bits // 4, random.getrandbits(bits))  # nosec B311
+
+
+def is_hex_id(value, size):
+    # lowercase hex, not all zeros
+    return (len(value) == size and value.strip('0') != '' and
+            value.strip('0123456789abcdef') == '')
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+
+    if isinstance(value, int):
+        return {'intValue': str(value)}  # int64 is a string in OTLP/JSON
+
+    if isinstance(value, float):
+        return {'doubleValue': value}
+
+    if isinstance(value, bytes):
+        value = value.decode('latin-1')
+
+    return {'stringValue': str(value)}
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'kind', 'start',
+                 'end', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id=None, kind=1, start=None,
+                 attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.kind = kind  # 1: internal, 2: server
+        self.start = perf_counter() if start is None else start
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, SystemExit):
+            self.error = f'{exc_type.__name__}: {exc}'
+
+        self.finish()
+
+    def finish(self, end=None):
+        if self.end is None:
+            self.end = perf_counter() if end is None else end
+            self.trace.spans.append(self)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        data = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.trace.unix_nano(self.start)),
+            'endTimeUnixNano': str(self.trace.unix_nano(self.end)),
+            'attributes': [
+                {'key': key, 'value': otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            'status': {'code': 1}  # ok
+        }
+
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+
+        if self.error is not None:
+            data['status'] = {'code': 2, 'message': self.error}
+
+        return data
+
+
+class Trace:
+    # the spans of a request. they are appended from both the event loop
+    # and the script thread, list.append() is atomic
+    def __init__(self, name, traceparent=None, attributes=None):
+        self.trace_id = None
+        parent_id = None
+
+        if traceparent:
+            # W3C Trace Context, e.g. 00-<trace-id>-<parent-id>-01
+            parts = traceparent.split('-')
+
+            if (len(parts) == 4 and is_hex_id(parts[1], 32) and
+                    is_hex_id(parts[2], 16)):
+                self.trace_id = parts[1]
+                parent_id = parts[2]
+
+        if self.trace_id is None:
+            self.trace_id = new_id(128)
+
+        # maps perf_counter() to the wall clock
+        self.origin = time.time_ns()
+        self.origin_perf = perf_counter()
+        self.spans = []
+        self.root = Span(self, name, parent_id, kind=2,
+                         start=self.origin_perf, attributes=attributes)
+
+    def unix_nano(self, value):
+        return self.origin + int((value - self.origin_perf) * 1e9)
+
+    def span(self, name, **attributes):
+        # with trace.span('name'): ...
+        return Span(self, name, self.root.span_id, attributes=attributes)
+
+    def add(self, name, start, end, **attributes):
+        # a span from the timestamps taken already
+        Span(self, name, self.root.span_id, start=start,
+             attributes=attributes).finish(end)
+
+    def server_timing(self):
+        # the total duration of the finished spans of each name
+        durations = {}
+
+        for span in self.spans:
+            name = span.name.partition(' ')[0]
+            durations[name] = durations.get(name, 0) + span.duration
+
+        return ', '.join('%s;dur=%.3f' % (name, duration * 1000)
+                         for name, duration in durations.items())
+
+
+class SpanFormatter(logging.Formatter):
+    def format(self, record):
+        return '\n'.join(json.dumps(span.to_dict()) for span in record.spans)
+
+
+class Tracer:
+    # writes the finished traces as JSON lines, one span per line,
+    # in the OTLP/JSON span shape, from a background thread
+    def __init__(self, filename=None, server_timing=False):
+        self.filename = filename
+        self.server_timing = server_timing
+        self.listener = None
+
+        if filename is not None:
+            self.handler = logging.FileHandler(filename, delay=True)
+            self.handler.setFormatter(SpanFormatter())
+            self.queue = queue.SimpleQueue()
+            self.queue_handler = LazyQueueHandler(self.queue)
+            self.listener = QueueListener(self.queue, self.handler)
+
+    def start(self):
+        if self.listener is not None:
+            self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.handler.close()
+
+    def new_trace(self, request):
+        # a repeated header is a list, it is ignored
+        traceparent = request.headers.get(b'traceparent')
+
+        return Trace(
+            'HTTP %s' % request.method.decode('latin-1'),
+            traceparent.decode('latin-1')
+            if isinstance(traceparent, bytes) else None,
+            attributes={
+                'http.request.method': request.method,
+                'url.path': request.path,
+                'client.address': request.ip
+            }
+        )
+
+    def export(self, trace, **attributes):
+        trace.root.attributes.update(attributes)
+        trace.root.finish()
+
+        if self.listener is not None:
+            self.queue_handler.handle(logging.makeLogRecord({
+                'name': 'httpout.trace',
+                'levelno': logging.INFO,
+                'levelname': 'INFO',
+                'msg': 'trace',
+                'spans': trace.spans
+            }))
@@ -0,0 +1,99 @@
+# Copyright (c) 2024 nggit
+
+import errno
+import io
+import os
+
+
+class UploadFile:
+    # an uploaded file, kept in memory until it exceeds spool_size,
+    # then written to a temporary file in dir
+    def __init__(self, name, filename, content_type='application/octet-stream',
+                 *, spool_size=1048576, dir=None):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.spool_size = spool_size
+        self.dir = dir
+        self.size = 0
+        self.file = io.BytesIO()
+        self._path = None
+
+    def __getattr__(self, name):
+        # read(), seek(), readline(), etc.
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __repr__(self):
+        return '<UploadFile name=%r filename=%r size=%d>' % (
+            self.name, self.filename, self.size
+        )
+
+    @property
+    def path(self):
+        # the file is moved to the disk, if it is not already there
+        self.rollover()
+        self.file.flush()
+
+        return self._path
+
+    def spooled(self, size=0):
+        # whether the file is or will be on the disk after writing size bytes
+        return self._path is not None or self.size + size > self.spool_size
+
+    def rollover(self):
+        if self._path is not None:
+            return
+
+        import tempfile
+
+        fd, self._path = tempfile.mkstemp(prefix='httpout-', dir=self.dir)
+        file = os.fdopen(fd, 'w+b')
+
+        try:
+            file.write(self.file.getvalue())
+            file.seek(self.file.tell())
+        except BaseException:
+            file.close()
+            os.unlink(self._path)
+            self._path = None
+            raise
+
+        self.file = file
+
+    def write(self, data):
+        if self.spooled(len(data)):
+            self.rollover()
+
+        self.size += self.file.write(data)
+
+    def move(self, dst):
+        # a rename, without copying, if dst is on the same filesystem as dir
+        path = self.path
+        self.file.close()
+
+        try:
+            os.replace(path, dst)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+
+            import shutil
+
+            shutil.move(path, dst)
+
+        self._path = None
+        return dst
+
+    def close(self):
+        self.file.close()
+
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+            self._path = None
@@ -0,0 +1,98 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+import sys
+import threading
+import traceback
+
+from time import perf_counter
+
+
+def format_stack(thread_id):
+    frame = sys._current_frames().get(thread_id)
+
+    if frame is None:
+        return ''
+
+    return ''.join(traceback.format_stack(frame))
+
+
+def set_async_exc(thread_id, exc_type):
+    # the exception is raised at the next bytecode of the thread,
+    # not while it is blocked in a C call, e.g. socket.recv()
+    import ctypes
+
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        ctypes.py_object() if exc_type is None else ctypes.py_object(exc_type)
+    ) == 1
+
+
+class Watchdog:
+    # reports the scripts running longer than timeout with the stack of
+    # their thread, and optionally interrupts them with exc_type
+    def __init__(self, requests, logger, timeout, exc_type=None,
+                 metrics=None):
+        self.requests = requests  # in-flight servers, see g.requests
+        self.logger = logger
+        self.timeout = timeout
+        self.exc_type = exc_type
+        self.exc_types = () if exc_type is None else (exc_type,)
+        self.metrics = metrics
+        self.interval = min(timeout / 2, 1)
+        self._lock = threading.Lock()
+
+    def enter(self, server):
+        # called by the executor thread, before running the script
+        server['thread_id'] = threading.get_ident()
+        server['timings']['exec'] = perf_counter()
+
+    def leave(self, server):
+        with self._lock:
+            server['timings']['exec_end'] = perf_counter()
+
+            if server.pop('interrupted', False):
+                # it may have returned before the exception was raised,
+                # don't let it leak into the next job of the thread
+                set_async_exc(server['thread_id'], None)
+
+    def check(self):
+        now = perf_counter()
+
+        for server in list(self.requests.values()):
+            timings = server['timings']
+
+            if ('thread_id' not in server or 'exec_end' in timings or
+                    now < server.get('deadline', timings['exec'] +
+                                     self.timeout)):
+                continue
+
+            # reported again every timeout seconds while it is running
+            server['deadline'] = now + self.timeout
+            self.logger.warning(
+                'slow request: %s (%s) has been running for %.3fs '
+                'in thread %d\n%s',
+                server['SCRIPT_NAME'], server['REQUEST_URI'],
+                now - timings['exec'], server['thread_id'],
+                format_stack(server['thread_id']).rstrip()
+            )
+
+            if self.metrics is not None:
+                self.metrics.inc('httpout_slow_requests_total',
+                                 script=server['SCRIPT_NAME'])
+
+            if self.exc_type is not None:
+                self.interrupt(server)
+
+    def interrupt(self, server):
+        with self._lock:
+            if 'exec_end' in server['timings']:
+                return False
+
+            server['interrupted'] = True
+            return set_async_exc(server['thread_id'], self.exc_type)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
@@ -0,0 +1,76 @@
+# Copyright (c) 2024 nggit
+
+import asyncio
+
+
+class WebSocket:
+    # on the loop, the methods return the coroutines of tremolo's WebSocket.
+    # in the script thread, they block instead, and send() is buffered
+    def __init__(self, websocket, response):
+        self.websocket = websocket
+        self.response = response
+        self.loop = response.loop
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+    def __aiter__(self):
+        return self.websocket.__aiter__()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.recv()
+
+        if data is None:
+            raise StopIteration
+
+        return data
+
+    def in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def wait(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def accept(self):
+        if self.in_loop():
+            return self.websocket.accept()
+
+        self.wait(self.websocket.accept())
+
+    def recv(self):
+        if self.in_loop():
+            return self.websocket.recv()
+
+        # a whole message, or None once the client has closed the connection
+        try:
+            return self.wait(self.websocket.__anext__())
+        except StopAsyncIteration:
+            return None
+
+    def send(self, payload_data, fin=1, opcode=None):
+        if self.in_loop():
+            return self.websocket.send(payload_data, fin=fin, opcode=opcode)
+
+        if not self.websocket.request.upgraded:
+            self.accept()
+
+        # coalesced with the other frames, like print()
+        self.response.write_buffered(
+            self.websocket.create_frame(payload_data, fin=fin, opcode=opcode)
+        )
+
+    async def _close(self, code):
+        await self.response.drain()
+        await self.websocket.close(code)
+
+    def close(self, code=1000):
+        if self.in_loop():
+            return self.websocket.close(code)
+
+        self.wait(self._close(code))
@@ -2,8 +2,10 @@
 
 import multiprocessing as mp
 import os
+import shutil
 import sys
 import signal
+import tempfile
 import unittest
 
 PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,6 +15,7 @@ sys.path.insert(0, PROJECT_DIR)
 
 from tremolo import Application  # noqa: E402
 from httpout import HTTPOut  # noqa: E402
+from httpout.utils import SharedState  # noqa: E402
 
 app = Application()
 
@@ -20,29 +23,65 @@ HTTPOut(app)
 
 HTTP_HOST = '127.0.0.1'
 HTTP_PORT = 28008
+# a separate server for the features that interfere with the scripts
+FEATURES_PORT = 28009
 DOCUMENT_ROOT = os.path.join(PROJECT_DIR, 'examples')
+# without the __globals__.py of the examples
+FEATURES_ROOT = os.path.join(DOCUMENT_ROOT, 'features')
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'httpout-tests')
+ACCESS_LOG = os.path.join(PROFILE_DIR, 'access.log')
+UPLOAD_DIR = os.path.join(PROFILE_DIR, 'uploads')
+TRACE_FILE = os.path.join(PROFILE_DIR, 'trace.jsonl')
 
 
 def main():
     mp.set_start_method('spawn', force=True)
 
+    for filename in (ACCESS_LOG, TRACE_FILE):
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+    shutil.rmtree(UPLOAD_DIR, ignore_errors=True)
+
+    shared = SharedState()
     p = mp.Process(
         target=app.run,
         kwargs=dict(
             host=HTTP_HOST, port=HTTP_PORT,
             document_root=DOCUMENT_ROOT, app=None, debug=False,
-            server_name='HTTPOut'
+            server_name='HTTPOut', shared=shared, metrics_path='/metrics',
+            profile_secret='secret', profile_dir=PROFILE_DIR,
+            access_log=ACCESS_LOG, access_log_json=True, stdin=True,
+            upload_dir=UPLOAD_DIR, upload_spool_size=64,
+            coalesce=['/coalesce.py', '/coalesce_flush.py'],
+            trace_file=TRACE_FILE,
+            server_timing=True
         )
     )
     p.start()
 
+    features = mp.Process(
+        target=app.run,
+        kwargs=dict(
+            host=HTTP_HOST, port=FEATURES_PORT,
+            document_root=FEATURES_ROOT, app=None, debug=False,
+            server_name='HTTPOut', slow_request_timeout=2,
+            slow_request_exception='TimeoutError', memory_sample_rate=1,
+            memory_report_path='/memory', gc_policy='idle'
+        )
+    )
+    features.start()
+
     try:
         suite = unittest.TestLoader().discover('tests')
         unittest.TextTestRunner().run(suite)
     finally:
-        if p.is_alive():
-            os.kill(p.pid, signal.SIGTERM)
-            p.join()
+        for process in (p, features):
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+                process.join()
+
+        shared.close()
 
 
 if __name__ == '__main__':
@@ -9,7 +9,10 @@ from io import StringIO
 # makes imports relative from the repo directory
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from httpout.__main__ import usage, bind, version, threads  # noqa: E402
+from httpout.__main__ import (  # noqa: E402
+    usage, bind, version, threads, shared_memory, max_write_buffer,
+    memory_sample_rate, preload, preload_modules, startup_profile
+)
 from tremolo.utils import parse_args  # noqa: E402
 
 STDOUT = sys.stdout
@@ -17,7 +20,11 @@ STDOUT = sys.stdout
 
 def run():
     return parse_args(
-        help=usage, bind=bind, version=version, thread_pool_size=threads
+        help=usage, bind=bind, version=version, thread_pool_size=threads,
+        shared_memory_size=shared_memory,
+        max_write_buffer_size=max_write_buffer,
+        memory_sample_rate=memory_sample_rate, preload=preload,
+        preload_modules=preload_modules, startup_profile=startup_profile
     )
 
 
@@ -133,6 +140,64 @@ class TestCLI(unittest.TestCase):
         self.assertEqual(self.output.getvalue()[:15], 'Invalid --bind ')
         self.assertEqual(code, 1)
 
+    def test_cli_invalid_shared_memory_size(self):
+        sys.argv.extend(['--shared-memory-size', '64k'])
+
+        code = 0
+        sys.stdout = self.output
+
+        try:
+            run()
+        except SystemExit as exc:
+            if exc.code:
+                code = exc.code
+
+        sys.stdout = STDOUT
+
+        self.assertEqual(self.output.getvalue()[:29],
+                         'Invalid --shared-memory-size ')
+        self.assertEqual(code, 1)
+
+    def test_cli_invalid_max_write_buffer_size(self):
+        sys.argv.extend(['--max-write-buffer-size', '64k'])
+
+        code = 0
+        sys.stdout = self.output
+
+        try:
+            run()
+        except SystemExit as exc:
+            if exc.code:
+                code = exc.code
+
+        sys.stdout = STDOUT
+
+        self.assertEqual(self.output.getvalue()[:32],
+                         'Invalid --max-write-buffer-size ')
+        self.assertEqual(code, 1)
+
+    def test_cli_invalid_memory_sample_rate(self):
+        for value in ('0', '1%'):
+            sys.argv.clear()
+            sys.argv.extend(['--memory-sample-rate', value])
+
+            code = 0
+            self.output.seek(0)
+            self.output.truncate()
+            sys.stdout = self.output
+
+            try:
+                run()
+            except SystemExit as exc:
+                if exc.code:
+                    code = exc.code
+
+            sys.stdout = STDOUT
+
+            self.assertEqual(self.output.getvalue()[:29],
+                             'Invalid --memory-sample-rate ')
+            self.assertEqual(code, 1)
+
     def test_cli_invalidarg(self):
         sys.argv.append('--invalid')
 
@@ -168,6 +233,22 @@ class TestCLI(unittest.TestCase):
         self.assertEqual(self.output.getvalue(), '')
         self.assertEqual(code, 0)
 
+    def test_cli_preload_modules(self):
+        sys.argv.extend(['', '--preload-modules', 'json, email,'])
+
+        options = run()
+
+        self.assertTrue(options['preload'])
+        self.assertEqual(options['preload_modules'], ['json', 'email'])
+
+    def test_cli_startup_profile(self):
+        sys.argv.extend(['', '--startup-profile', '/home/user/public_html'])
+
+        options = run()
+
+        self.assertTrue(options['startup_profile'])
+        self.assertFalse('preload' in options)
+
 
 if __name__ == '__main__':
     unittest.main()
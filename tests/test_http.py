@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
 import os
 import sys
+import time
 import unittest
 
+from concurrent.futures import ThreadPoolExecutor
+
 # makes imports relative from the repo directory
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tests.__main__ import main, HTTP_HOST, HTTP_PORT  # noqa: E402
-from tests.utils import getcontents  # noqa: E402
+from tests.__main__ import (  # noqa: E402
+    main, HTTP_HOST, HTTP_PORT, FEATURES_PORT, PROFILE_DIR, ACCESS_LOG,
+    UPLOAD_DIR, TRACE_FILE
+)
+from tremolo.lib.websocket import WebSocket  # noqa: E402
+from tests.utils import (  # noqa: E402
+    getcontents, read_chunked, read_header
+)
 
 
 class TestHTTP(unittest.TestCase):
@@ -164,6 +175,508 @@ class TestHTTP(unittest.TestCase):
         self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
         self.assertEqual(body, b'7\r\nHello, \r\n7\r\nWorld!\n\r\n0\r\n\r\n')
 
+    def test_print_backpressure(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/stream.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+
+        self.assertEqual(
+            read_chunked(body),
+            b''.join(b'line %d\n' % i for i in range(10000))
+        )
+
+    def test_print_backpressure_run(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/run_stream.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            read_chunked(body),
+            b'x' * 1048576 + b'\nwaited for main(): False\n'
+        )
+
+    def test_write_bytes(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/bytes.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertTrue(
+            b'\r\nContent-Type: application/octet-stream' in header
+        )
+        self.assertEqual(read_chunked(body), bytes(range(10)) + b'!!')
+
+    def test_request_stream(self):
+        data = 'x' * 1048576
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='POST',
+                                   url='/upload.py',
+                                   version='1.1',
+                                   headers=['Content-Type: text/plain'],
+                                   data=data)
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            body,
+            b'49\r\n1048576 %s\n\r\n0\r\n\r\n' %
+            hashlib.sha256(data.encode()).hexdigest().encode()
+        )
+
+    def test_request_stream_chunked(self):
+        header, body = getcontents(
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            raw=b'POST /upload.py HTTP/1.1\r\nHost: localhost\r\n'
+                b'Transfer-Encoding: chunked\r\n\r\n'
+                b'5\r\nHello\r\n8\r\n, World!\r\n0\r\n\r\n'
+        )
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            body,
+            b'44\r\n13 %s\n\r\n0\r\n\r\n' %
+            hashlib.sha256(b'Hello, World!').hexdigest().encode()
+        )
+
+    def test_stdin(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='POST',
+                                   url='/stdin.py',
+                                   version='1.1',
+                                   headers=['Content-Type: text/plain'],
+                                   data='foo\nbar\n')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(body, b'8\r\nFOO\nBAR\n\r\n0\r\n\r\n')
+
+    def test_files(self):
+        content = ''.join(chr(i % 256) for i in range(200000))
+        data = (
+            '--boundary\r\n'
+            'Content-Disposition: form-data; name="foo"\r\n\r\n'
+            'bar\r\n'
+            '--boundary\r\n'
+            'Content-Disposition: form-data; name="a"; filename="a.txt"\r\n'
+            'Content-Type: text/plain\r\n\r\n'
+            'Hello, World!\r\n'
+            '--boundary\r\n'
+            'Content-Disposition: form-data; name="b"; filename="b.bin"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            '%s\r\n'
+            '--boundary--\r\n' % content
+        )
+        header, body = getcontents(
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            method='POST',
+            url='/files.py',
+            version='1.1',
+            headers=['Content-Type: multipart/form-data; boundary=boundary'],
+            data=data
+        )
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            read_chunked(body),
+            b'a a.txt text/plain 13 %s False\n'
+            b'b b.bin application/octet-stream 200000 %s True\n'
+            b'{\'foo\': [\'bar\']}\n' % (
+                hashlib.sha256(b'Hello, World!').hexdigest().encode(),
+                hashlib.sha256(content.encode('latin-1')).hexdigest().encode()
+            )
+        )
+
+        # the spooled files are removed after the request
+        self.assertEqual(os.listdir(UPLOAD_DIR), [])
+
+    def test_websocket_hub(self):
+        header, body = getcontents(
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            raw=b'GET /chat.py HTTP/1.1\r\nHost: localhost\r\n'
+                b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+                b'Sec-WebSocket-Version: 13\r\n\r\n' +
+                WebSocket.create_frame('hello', mask=True) +
+                WebSocket.create_frame(b'\x03\xe8', opcode=8, mask=True)
+        )
+
+        self.assertEqual(
+            header[:header.find(b'\r\n')],
+            b'HTTP/1.1 101 Switching Protocols'
+        )
+        self.assertEqual(
+            body,
+            WebSocket.create_frame('joined') +
+            WebSocket.create_frame('hello') +
+            WebSocket.create_frame(b'\x03\xe8', opcode=8)
+        )
+
+    def test_shared(self):
+        values = []
+
+        for _ in range(2):
+            header, body = getcontents(host=HTTP_HOST,
+                                       port=HTTP_PORT,
+                                       method='GET',
+                                       url='/shared.py',
+                                       version='1.1')
+
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            values.append(int(body.split(b'\r\n')[1]))
+
+        self.assertEqual(values[1], values[0] + 1)
+
+    def test_coalesce(self):
+        def get(_):
+            return getcontents(host=HTTP_HOST,
+                               port=HTTP_PORT,
+                               method='GET',
+                               url='/coalesce.py',
+                               version='1.1')
+
+        with ThreadPoolExecutor(3) as executor:
+            responses = list(executor.map(get, range(3)))
+
+        for header, body in responses:
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            self.assertEqual(read_chunked(body), b'Hello, World!\n')
+
+        # a single execution
+        self.assertEqual(
+            len({bytes(read_header(header, b'X-Execution')[0])
+                 for header, body in responses}),
+            1
+        )
+
+    def test_coalesce_flush_finish(self):
+        def get(_):
+            return getcontents(host=HTTP_HOST,
+                               port=HTTP_PORT,
+                               method='GET',
+                               url='/coalesce_flush.py',
+                               version='1.1')
+
+        with ThreadPoolExecutor(2) as executor:
+            responses = list(executor.map(get, range(2)))
+
+        for header, body in responses:
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            # no empty chunks from flush_headers() or finish()
+            self.assertEqual(body, b'E\r\nHello, World!\n\r\n0\r\n\r\n')
+
+        self.assertEqual(
+            len({bytes(read_header(header, b'X-Execution')[0])
+                 for header, body in responses}),
+            1
+        )
+
+    def test_executor_saturated(self):
+        # more scripts than the 5 executor threads
+        def get(_):
+            return getcontents(host=HTTP_HOST,
+                               port=HTTP_PORT,
+                               method='GET',
+                               url='/busy.py',
+                               version='1.1')
+
+        start = time.time()
+
+        with ThreadPoolExecutor(12) as executor:
+            responses = list(executor.map(get, range(12)))
+
+        # spread over the threads, 3 rounds at most rather than 12
+        self.assertTrue(time.time() - start < 2.5)
+
+        for header, body in responses:
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            self.assertEqual(read_chunked(body), b'Done!\n')
+
+    def test_finish(self):
+        values = []
+
+        for _ in range(2):
+            start = time.time()
+            header, body = getcontents(host=HTTP_HOST,
+                                       port=HTTP_PORT,
+                                       method='GET',
+                                       url='/finish.py',
+                                       version='1.1')
+
+            # the script is still running
+            self.assertTrue(time.time() - start < 0.5)
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            values.append(int(read_chunked(body)))
+
+            # the deferred callable runs after the script
+            time.sleep(0.7)
+
+        self.assertEqual(values[1], values[0] + 1)
+
+    def test_early_hints(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/hints.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')],
+                         b'HTTP/1.1 103 Early Hints')
+        self.assertTrue(header.endswith(
+            b'\r\nLink: </static/style.css>; rel=preload; as=style'
+        ))
+
+        header, body = body.split(b'\r\n\r\n', 1)
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            read_chunked(body),
+            b'<link rel="stylesheet" href="/static/style.css">Hello, World!\n'
+        )
+
+    def test_flush_headers_head(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='HEAD',
+                                   url='/coalesce_flush.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertTrue(b'\r\nTransfer-Encoding: chunked' in header)
+        self.assertTrue(b'\r\nConnection: close' in header)
+        self.assertTrue(read_header(header, b'X-Execution')[0].isdigit())
+        self.assertEqual(body, b'')
+
+    def test_pool(self):
+        # max_size=1, the second request will time out
+        # if the connection is not returned to the pool
+        for _ in range(2):
+            header, body = getcontents(host=HTTP_HOST,
+                                       port=HTTP_PORT,
+                                       method='GET',
+                                       url='/pool.py',
+                                       version='1.1')
+
+            self.assertEqual(header[:header.find(b'\r\n')],
+                             b'HTTP/1.1 200 OK')
+            self.assertEqual(body, b'2\r\n2\n\r\n0\r\n\r\n')
+
+    def test_metrics(self):
+        getcontents(host=HTTP_HOST,
+                    port=HTTP_PORT,
+                    method='GET',
+                    url='/environ.py',
+                    version='1.1')
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/metrics',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertTrue(b'\r\nContent-Type: text/plain; version=0.0.4' in
+                        header)
+        self.assertTrue(
+            b'\nhttpout_requests_total{script="/environ.py"} ' in body
+        )
+        self.assertTrue(
+            b'\nhttpout_request_phase_seconds_count'
+            b'{script="/environ.py",phase="exec"} ' in body
+        )
+        self.assertTrue(b'\nhttpout_executor_queue_depth ' in body)
+        self.assertTrue(
+            b'\nhttpout_gc_pause_seconds_count{generation="2"} ' in body
+        )
+
+    def test_profile(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/environ.py',
+                                   headers=['X-Profile: secret'],
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(body, b'13\r\nb\'GET\' /environ.py\n\r\n0\r\n\r\n')
+
+        filename = read_header(header, b'X-Profile-Report')[0].decode()
+        self.assertTrue(
+            os.path.isfile(os.path.join(PROFILE_DIR, filename))
+        )
+
+    def test_profile_bad_secret(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=HTTP_PORT,
+                                   method='GET',
+                                   url='/environ.py',
+                                   headers=['X-Profile: guess'],
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(read_header(header, b'X-Profile-Report'), [])
+
+    def test_access_log(self):
+        for url, headers in (
+                ('/environ.py?access_log', ['User-Agent: tests']),
+                ('/notfound.py?access_log', ['User-Agent: tests']),
+                ('/environ.py?access_log=2',
+                 ['User-Agent: tests', 'User-Agent: tests'])):
+            getcontents(host=HTTP_HOST,
+                        port=HTTP_PORT,
+                        method='GET',
+                        url=url,
+                        headers=headers,
+                        version='1.1')
+
+        # written by a background thread
+        for _ in range(50):
+            time.sleep(0.1)
+
+            if os.path.exists(ACCESS_LOG):
+                with open(ACCESS_LOG, 'r') as f:
+                    records = [json.loads(line) for line in f
+                               if '?access_log' in line]
+
+                if len(records) == 3:
+                    break
+
+        self.assertEqual(
+            [(r['method'], r['uri'], r['status'], r['script'], r['user_agent'])
+             for r in records],
+            [('GET', '/environ.py?access_log', 200, '/environ.py', 'tests'),
+             ('GET', '/notfound.py?access_log', 404, '-', 'tests'),
+             ('GET', '/environ.py?access_log=2', 200, '/environ.py', '-')]
+        )
+        self.assertEqual(records[0]['size'], 30)
+
+    def test_trace(self):
+        trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+        header, body = getcontents(
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            method='GET',
+            url='/environ.py?trace',
+            headers=[f'traceparent: 00-{trace_id}-00f067aa0ba902b7-01'],
+            version='1.1'
+        )
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+
+        server_timing = read_header(header, b'Server-Timing')[0]
+        self.assertTrue(server_timing.startswith(b'route;dur='))
+        self.assertTrue(b', queue;dur=' in server_timing)
+
+        # written by a background thread
+        for _ in range(50):
+            time.sleep(0.1)
+
+            if os.path.exists(TRACE_FILE):
+                with open(TRACE_FILE, 'r') as f:
+                    spans = [json.loads(line) for line in f
+                             if trace_id in line]
+
+                if any(span['kind'] == 2 for span in spans):
+                    break
+
+        names = [span['name'] for span in spans]
+
+        for name in ('route', 'queue', 'exec', 'flush', 'cleanup', 'HTTP GET'):
+            self.assertTrue(name in names)
+
+        root = spans[names.index('HTTP GET')]
+        self.assertEqual(root['parentSpanId'], '00f067aa0ba902b7')
+        self.assertTrue(
+            {'key': 'http.response.status_code', 'value': {'intValue': '200'}}
+            in root['attributes']
+        )
+
+        for span in spans:
+            if span is not root:
+                self.assertEqual(span['parentSpanId'], root['spanId'])
+
+    def test_trace_repeated_header(self):
+        header, body = getcontents(
+            host=HTTP_HOST,
+            port=HTTP_PORT,
+            method='GET',
+            url='/environ.py?trace',
+            headers=[
+                'traceparent: 00-4bf92f3577b34da6a3ce929d0e0e4736-'
+                '00f067aa0ba902b7-01',
+                'traceparent: 00-0af7651916cd43dd8448eb211c80319c-'
+                'b7ad6b7169203331-01'
+            ],
+            version='1.1'
+        )
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(
+            body, b'19\r\nb\'GET\' /environ.py?trace\n\r\n0\r\n\r\n'
+        )
+
+    def test_slow_request(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=FEATURES_PORT,
+                                   method='GET',
+                                   url='/slow.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')],
+                         b'HTTP/1.1 500 Internal Server Error')
+        self.assertTrue(b'TimeoutError' in body)
+
+    def test_memory_report(self):
+        getcontents(host=HTTP_HOST,
+                    port=FEATURES_PORT,
+                    method='GET',
+                    url='/hello.py',
+                    version='1.1')
+
+        # recorded a second after the request, in the background
+        for _ in range(50):
+            time.sleep(0.1)
+            header, body = getcontents(host=HTTP_HOST,
+                                       port=FEATURES_PORT,
+                                       method='GET',
+                                       url='/memory',
+                                       version='1.0')
+
+            if b'\n/hello.py ' in body:
+                break
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.0 200 OK')
+        self.assertTrue(b'\r\nContent-Type: text/plain' in header)
+        self.assertTrue(body.startswith(b'# '))
+        self.assertTrue(b' requests, sampled 1 in 1\n' in body)
+        self.assertTrue(b'\n/hello.py ' in body)
+        self.assertTrue(b'\n# /hello.py top allocation sites\n' in body)
+
+    def test_gc_policy_idle(self):
+        header, body = getcontents(host=HTTP_HOST,
+                                   port=FEATURES_PORT,
+                                   method='GET',
+                                   url='/hello.py',
+                                   version='1.1')
+
+        self.assertEqual(header[:header.find(b'\r\n')], b'HTTP/1.1 200 OK')
+        self.assertEqual(read_chunked(body), b'Hello, World!\n')
+
     def test_static_index(self):
         header, body = getcontents(host=HTTP_HOST,
                                    port=HTTP_PORT,
@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+
+import asyncio
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from httpout.httpout import pick_thread, run_module  # noqa: E402
+from httpout.utils import is_safe_path, resolve_path  # noqa: E402
+from httpout.utils.collector import Collector  # noqa: E402
+from httpout.utils.deploy import Deploys  # noqa: E402
+from httpout.utils.imports import ImportGraph  # noqa: E402
+from httpout.utils.memory import MemoryTracker  # noqa: E402
+from httpout.utils.metrics import Metrics  # noqa: E402
+from httpout.utils.recycle import EXIT_CODE, Recycler  # noqa: E402
+from httpout.utils.tracing import Trace, current_trace  # noqa: E402
+from httpout.utils.upload import UploadFile  # noqa: E402
+from httpout.utils.watchdog import Watchdog  # noqa: E402
+
+DOCUMENT_ROOT = os.path.abspath(os.sep + os.path.join('srv', 'docroot'))
+PARTS = ('/', '/', '/', '.', '..', '...', '.py', '.py/', 'a', 'b.py',
+         '_c', 'd-e', '.well-known', '.git', '%2e', '\\', '~', ' ')
+
+
+# the previous path handling of HTTPOut._on_request, used as a reference
+def legacy_resolve(path, document_root=DOCUMENT_ROOT):
+    path_info = path[(path + '.py/').find('.py/') + 3:]
+
+    if path_info:
+        path = path[:path.rfind(path_info)]
+        path_info = os.path.normpath(path_info).replace(os.sep, '/')
+
+    module_path = os.path.abspath(
+        os.path.join(document_root, os.path.normpath(path.lstrip('/')))
+    )
+
+    if not module_path.startswith(document_root):
+        raise ValueError('Path traversal is not allowed')
+
+    if '/.' in path and not path.startswith('/.well-known/'):
+        raise ValueError('Access to dotfiles is prohibited')
+
+    if not is_safe_path(path):
+        raise ValueError('Unsafe URL detected')
+
+    return module_path, path_info
+
+
+class TestUtils(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+    def assertResolvesLikeLegacy(self, path):
+        try:
+            expected = legacy_resolve(path)
+        except ValueError as exc:
+            expected = exc
+
+        try:
+            segments, path_info, ext = resolve_path(path)
+        except ValueError as exc:
+            if path.startswith('/'):
+                self.assertEqual(str(exc), str(expected), path)
+            elif not isinstance(expected, ValueError):
+                # the legacy code let dotfiles pass without the leading slash
+                self.assertEqual(str(exc), 'Access to dotfiles is prohibited')
+
+            return
+
+        self.assertNotIsInstance(expected, ValueError, path)
+        module_path = os.path.join(DOCUMENT_ROOT, *segments)
+
+        self.assertEqual((module_path, path_info), expected, path)
+        self.assertEqual(
+            ext, os.path.splitext(segments[-1])[-1] if segments else '', path
+        )
+
+    def test_resolve_path(self):
+        for path, expected in (
+                ('/', ([], '', '')),
+                ('/home/', (['home'], '', '')),
+                ('/foo.py', (['foo.py'], '', '.py')),
+                ('/a/b.py/c/../d/', (['a', 'b.py'], '/d', '.py')),
+                ('/a//b.html', (['a', 'b.html'], '', '.html')),
+                ('/.well-known/acme', (['.well-known', 'acme'], '', ''))):
+            self.assertEqual(resolve_path(path), expected)
+
+    def test_resolve_path_forbidden(self):
+        for path, message in (
+                ('/../etc/passwd', 'Path traversal is not allowed'),
+                ('/a/../../b.py/c', 'Path traversal is not allowed'),
+                ('/.git/config', 'Access to dotfiles is prohibited'),
+                ('.git/config', 'Access to dotfiles is prohibited'),
+                ('/a/../b', 'Access to dotfiles is prohibited'),
+                ('/.well-known/a/../b', 'Unsafe URL detected'),
+                ('/a%2e%2e/b', 'Unsafe URL detected'),
+                ('/a..b', 'Unsafe URL detected'),
+                ('/a\\..\\b', 'Unsafe URL detected'),
+                ('/' + 'a' * 255, 'Unsafe URL detected')):
+            with self.assertRaises(ValueError) as cm:
+                resolve_path(path)
+
+            self.assertEqual(str(cm.exception), message, path)
+
+    def test_resolve_path_fuzz(self):
+        rand = random.Random(0)
+
+        for _ in range(20000):
+            path = ''.join(
+                rand.choice(PARTS) for _ in range(rand.randint(0, 12))
+            )
+
+            if rand.random() < 0.9:
+                path = '/' + path
+
+            self.assertResolvesLikeLegacy(path)
+
+    def test_resolve_path_length(self):
+        for size in (254, 255, 256):
+            self.assertResolvesLikeLegacy('/' + 'a' * (size - 1))
+            self.assertResolvesLikeLegacy('/a.py/' + 'b' * size)
+
+    def test_upload_file_spool(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            upload = UploadFile('a', 'a.txt', spool_size=4, dir=tmpdir)
+            upload.write(b'foo')
+
+            self.assertFalse(upload.spooled())
+            self.assertEqual(os.listdir(tmpdir), [])
+
+            upload.write(b'bar')
+            upload.seek(0)
+
+            self.assertTrue(upload.spooled())
+            self.assertEqual(os.listdir(tmpdir),
+                             [os.path.basename(upload.path)])
+            self.assertEqual(upload.read(), b'foobar')
+
+            upload.close()
+            self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_upload_file_move(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            upload = UploadFile('a', 'a.txt', dir=tmpdir)
+            upload.write(b'foo')
+
+            dst = upload.move(os.path.join(tmpdir, 'a.txt'))
+            upload.close()
+
+            self.assertEqual(os.listdir(tmpdir), ['a.txt'])
+
+            with open(dst, 'rb') as f:
+                self.assertEqual(f.read(), b'foo')
+
+    def test_import_graph(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, 'lib'))
+            files = {
+                'main.py': 'import os\nimport lib.a\n',
+                os.path.join('lib', '__init__.py'): '',
+                os.path.join('lib', 'a.py'): 'from . import b\n',
+                os.path.join('lib', 'b.py'): 'X = 1\n'
+            }
+
+            for name, source in files.items():
+                with open(os.path.join(tmpdir, name), 'w') as f:
+                    f.write(source)
+
+            changes = []
+            imports = ImportGraph(
+                tmpdir, on_change=lambda *args: changes.append(args)
+            )
+            main = os.path.join(tmpdir, 'main.py')
+            lib = os.path.join(tmpdir, 'lib')
+
+            self.assertEqual(
+                imports.analyze(main),
+                {os.path.join(lib, name)
+                 for name in ('__init__.py', 'a.py', 'b.py')}
+            )
+            self.assertEqual(imports.dependents(os.path.join(lib, 'b.py')),
+                             {main, os.path.join(lib, 'a.py')})
+
+            code = imports.get_code(os.path.join(lib, 'b.py'))
+            self.assertIs(imports.get_code(os.path.join(lib, 'b.py')), code)
+
+            with open(os.path.join(lib, 'b.py'), 'w') as f:
+                f.write('X = 10\n')
+
+            self.assertIsNot(imports.get_code(os.path.join(lib, 'b.py')), code)
+            self.assertEqual(changes, [
+                (os.path.join(lib, 'b.py'), {main, os.path.join(lib, 'a.py')})
+            ])
+
+    def test_import_graph_preload(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, '.git'))
+            files = {
+                'a.py': 'import b\n',
+                'b.py': '',
+                'c.py': 'if\n',
+                'd.txt': '',
+                os.path.join('.git', 'e.py'): ''
+            }
+
+            for name, source in files.items():
+                with open(os.path.join(tmpdir, name), 'w') as f:
+                    f.write(source)
+
+            imports = ImportGraph(tmpdir)
+
+            self.assertEqual(imports.preload(), 2)
+            self.assertEqual(imports.as_dict(), {
+                os.path.join(tmpdir, 'a.py'): [os.path.join(tmpdir, 'b.py')],
+                os.path.join(tmpdir, 'b.py'): []
+            })
+
+    def test_deploys(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            current = os.path.join(tmpdir, 'current')
+            releases = [os.path.join(tmpdir, 'releases', str(i))
+                        for i in (1, 2)]
+
+            for release in releases:
+                os.makedirs(release)
+
+            os.symlink(releases[0], current)
+
+            retired = []
+            deploys = Deploys(current, lambda root: None, interval=0,
+                              on_retire=retired.append)
+            first = deploys.acquire()
+
+            self.assertEqual(first.root, os.path.realpath(releases[0]))
+
+            # swaps the symlink atomically, like a deploy does
+            os.symlink(releases[1], current + '.new')
+            os.replace(current + '.new', current)
+
+            second = deploys.acquire()
+
+            self.assertEqual(second.number, 2)
+            self.assertEqual(second.root, os.path.realpath(releases[1]))
+            self.assertEqual(retired, [])  # still in flight
+
+            deploys.release(second)
+            deploys.release(first)
+
+            self.assertEqual(retired, [first])
+            self.assertEqual(deploys.generations, [second])
+
+    def test_trace(self):
+        trace = Trace('HTTP GET', '00-0af7651916cd43dd8448eb211c80319c-'
+                                  'b7ad6b7169203331-01')
+
+        self.assertEqual(trace.trace_id, '0af7651916cd43dd8448eb211c80319c')
+        self.assertEqual(trace.root.parent_id, 'b7ad6b7169203331')
+
+        trace.add('import a', 1.0, 1.5)
+        trace.add('import b', 2.0, 2.25)
+
+        with self.assertRaises(ValueError):
+            with trace.span('run', coro='main'):
+                raise ValueError('oops')
+
+        self.assertTrue(trace.server_timing().startswith(
+            'import;dur=750.000, run;dur='
+        ))
+
+        span = trace.spans[-1].to_dict()
+
+        self.assertEqual(span['parentSpanId'], trace.root.span_id)
+        self.assertEqual(span['attributes'],
+                         [{'key': 'coro', 'value': {'stringValue': 'main'}}])
+        self.assertEqual(span['status'],
+                         {'code': 2, 'message': 'ValueError: oops'})
+
+        # an invalid traceparent starts a new trace
+        for traceparent in ('00-%s-b7ad6b7169203331-01' % ('0' * 32),
+                            '00-xyz-b7ad6b7169203331-01',
+                            '00-0af7651916cd43dd8448eb211c80319c-'
+                            'b7ad6b71692033zz-01',
+                            '00-0af7651916cd43dd8448eb211c80319c-'
+                            '0000000000000000-01',
+                            '00-0AF7651916CD43DD8448EB211C80319C-'
+                            'b7ad6b7169203331-01'):
+            trace = Trace('HTTP GET', traceparent)
+
+            self.assertEqual(len(trace.trace_id), 32)
+            self.assertEqual(trace.root.parent_id, None)
+
+    def test_watchdog(self):
+        def script():
+            watchdog.enter(server)
+            started.set()
+
+            try:
+                while True:
+                    time.sleep(0.01)
+            except TimeoutError:
+                result.append('interrupted')
+            finally:
+                watchdog.leave(server)
+
+        result = []
+        server = {'SCRIPT_NAME': '/slow.py', 'REQUEST_URI': '/slow.py?a=1',
+                  'timings': {}}
+        logger = logging.getLogger('test_watchdog')
+        watchdog = Watchdog({1: server}, logger, 0, exc_type=TimeoutError)
+        started = threading.Event()
+        thread = threading.Thread(target=script)
+
+        thread.start()
+        started.wait(5)
+
+        with self.assertLogs(logger, 'WARNING') as log:
+            watchdog.check()
+
+        thread.join(5)
+
+        self.assertEqual(result, ['interrupted'])
+        self.assertTrue('/slow.py (/slow.py?a=1)' in log.output[0])
+        self.assertTrue('in script' in log.output[0])
+        self.assertTrue('exec_end' in server['timings'])
+
+    def test_pick_thread(self):
+        jobs = {}
+
+        for _ in range(7):
+            thread = pick_thread(jobs, 3)
+            jobs[thread] = jobs.get(thread, 0) + 1
+
+        # idle first, then the least loaded
+        self.assertEqual(jobs, {0: 3, 1: 2, 2: 2})
+
+        del jobs[1]
+        self.assertEqual(pick_thread(jobs, 3), 1)
+
+    def test_watchdog_after_return(self):
+        class LateWatchdog(Watchdog):
+            def leave(self, server):
+                # the interrupt that was not raised in the script
+                if not server.pop('late', False):
+                    return super().leave(server)
+
+                raise TimeoutError
+
+        watchdog = LateWatchdog({}, logging.getLogger(), 0,
+                                exc_type=TimeoutError)
+        server = {'watchdog': watchdog, 'request': None, 'late': True,
+                  'trace': Trace('HTTP GET'),
+                  'timings': {'queue': time.perf_counter()}}
+        module = ModuleType('__main__')
+        module.__server__ = server
+
+        self.assertEqual(run_module(module, compile('', '<main>', 'exec'),
+                                    server['timings']), None)
+
+        # the state of the thread is reset for its next job
+        self.assertEqual(current_trace.get(), None)
+        self.assertTrue('exec_end' in server['timings'])
+
+    def test_memory_tracker(self):
+        history = []
+
+        async def request():
+            before = await tracker.sample()
+
+            history.append(bytearray(65536))  # outlives the request
+            tracker.track('/leak.py', before)
+            await asyncio.gather(*tracker.tasks)
+
+        with ThreadPoolExecutor(1) as executor:
+            tracker = MemoryTracker(executor, logging.getLogger(), rate=1,
+                                    delay=0)
+            tracker.start()
+
+            try:
+                for _ in range(2):
+                    asyncio.run(request())
+            finally:
+                tracker.stop()
+
+        route = tracker.routes['/leak.py']
+        report = tracker.render()
+
+        self.assertEqual(route.samples, 2)
+        self.assertTrue(route.retained >= 2 * 65536)
+        self.assertTrue('\n/leak.py 2 ' in report)
+        self.assertTrue('test_utils.py:' in report)
+
+        for rate in (0, -1):
+            with self.assertRaises(ValueError):
+                MemoryTracker(None, None, rate=rate)
+
+    def test_collector(self):
+        async def request():
+            collector.request_done()
+
+            # collected on the next iteration, once the response is sent
+            await asyncio.sleep(0)
+
+        metrics = Metrics()
+        metrics.histogram('httpout_gc_pause_seconds')
+        threshold = gc.get_threshold()
+        collector = Collector(asyncio.new_event_loop(), lambda: True,
+                              policy='idle', interval=0, metrics=metrics)
+
+        try:
+            collector.start()
+            self.assertEqual(gc.get_threshold()[2], 2 ** 31 - 1)
+
+            collector.loop.run_until_complete(request())
+            collector.loop.close()
+        finally:
+            collector.stop()
+            gc.unfreeze()
+
+        self.assertEqual(gc.get_threshold(), threshold)
+        self.assertTrue(collector.histograms[2].count >= 1)
+        self.assertTrue(
+            '\nhttpout_gc_pause_seconds_count{generation="2"} ' in
+            metrics.render()
+        )
+
+        with self.assertRaises(ValueError):
+            Collector(None, None, policy='never')
+
+    def test_collector_threshold(self):
+        threshold = gc.get_threshold()
+        collector = Collector(None, lambda: True, policy='idle',
+                              young_threshold=threshold[0] + 1)
+
+        try:
+            collector.start()
+
+            self.assertTrue(gc.get_freeze_count() > 0)
+            self.assertEqual(gc.get_threshold(),
+                             (threshold[0] + 1, threshold[1], 2 ** 31 - 1))
+        finally:
+            collector.stop()
+            gc.unfreeze()
+
+        self.assertEqual(gc.get_threshold(), threshold)
+
+        # the default policy leaves them as is
+        collector = Collector(None, lambda: True)
+        collector.start()
+
+        try:
+            self.assertEqual(gc.get_threshold(), threshold)
+            self.assertEqual(gc.get_freeze_count(), 0)
+        finally:
+            collector.stop()
+
+    def test_collector_request_done(self):
+        idle = [False]
+        loop = asyncio.new_event_loop()
+        collector = Collector(loop, lambda: idle[0], policy='idle',
+                              interval=1, max_interval=30)
+
+        try:
+            # busy, but not for long enough
+            collected_at = collector.collected_at = time.monotonic() - 2
+            collector.request_done()
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(collector.collected_at, collected_at)
+
+            # busy for too long, collected right away
+            collector.collected_at = time.monotonic() - 31
+            collector.request_done()
+            self.assertTrue(time.monotonic() - collector.collected_at < 1)
+
+            # idle, but within the interval
+            idle[0] = True
+            collected_at = collector.collected_at
+            collector.request_done()
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(collector.collected_at, collected_at)
+
+            # idle, collected after the response has been sent
+            collected_at = collector.collected_at = time.monotonic() - 2
+            collector.request_done()
+            self.assertEqual(collector.collected_at, collected_at)
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertTrue(collector.collected_at > collected_at)
+
+            # another request has started in the meantime
+            collected_at = collector.collected_at = time.monotonic() - 2
+            collector.request_done()
+            idle[0] = False
+            loop.run_until_complete(asyncio.sleep(0))
+            self.assertEqual(collector.collected_at, collected_at)
+        finally:
+            loop.close()
+
+    def test_recycler(self):
+        class Request:
+            protocol = transport = None
+            http_keepalive = True
+
+        Request.protocol = Request
+        requests = [Request() for _ in range(4)]
+        errors = []
+        loop = asyncio.new_event_loop()
+        loop.set_exception_handler(lambda loop, ctx: errors.append(ctx))
+        recycler = Recycler(loop, logging.getLogger(), lambda: True, 2,
+                            jitter=1)
+
+        self.assertTrue(recycler.max_requests in (2, 3))
+
+        for request in requests:
+            recycler.count(request)
+
+        try:
+            with self.assertRaises(SystemExit) as context:
+                loop.run_forever()
+
+            # the task is not awaited, like in the worker.
+            # tremolo runs the loop again to shut down
+            loop.run_until_complete(asyncio.sleep(0))
+            recycler.task = None
+            gc.collect()
+        finally:
+            loop.close()
+
+        self.assertEqual(context.exception.code, EXIT_CODE)
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            [request.http_keepalive for request in requests],
+            [True] * (recycler.max_requests - 1) +
+            [False] * (5 - recycler.max_requests)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
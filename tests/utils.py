@@ -1,4 +1,4 @@
-__all__ = ('read_header', 'getcontents')
+__all__ = ('read_header', 'read_chunked', 'getcontents')
 
 import socket  # noqa: E402
 import time  # noqa: E402
@@ -21,6 +21,17 @@ def read_header(header, key):
     return values
 
 
+def read_chunked(body):
+    data = bytearray()
+
+    while body:
+        size, _, body = body.partition(b'\r\n')
+        data.extend(body[:int(size, 16)])
+        body = body[int(size, 16) + 2:]
+
+    return bytes(data)
+
+
 # a simple HTTP client for tests
 def getcontents(host, port, method='GET', url='/', version='1.1', headers=(),
                 data='', raw=b'', timeout=10, max_retries=10):